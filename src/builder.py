@@ -6,7 +6,11 @@ from typing import List
 from flask import Flask
 
 from src.chain import Blockchain
+from src.http.gossip import Broadcaster
+from src.http.peers import PeerPool
+from src.ipc import MinerProcess
 from src.miner import Miner
+from src.utils import get_env_var
 from src.wallet import Wallet
 
 
@@ -15,22 +19,42 @@ class AppBuilder:
         self.flask = Flask(self.__module__)
         self.wallet = Wallet
         self._lock = threading.Lock()
-        self.miner = Miner(Blockchain(), debug=debug)
         self.nodes = nodes
+        self.miner_process = None
+        self.miner = None
+        if bool(int(get_env_var('MINER_PROCESS', 0))):  # mining doesn't share the GIL with the API
+            self.miner_process = MinerProcess(debug=debug)
+            self.blockchain = self.miner_process.blockchain
+            self.broadcaster = Broadcaster(PeerPool(nodes if nodes else []))
+        else:
+            self.miner = Miner(Blockchain(), debug=debug)
+            self.blockchain = self.miner.blockchain
+            self.broadcaster = self.miner.broadcaster
         atexit.register(self.exit)
 
         self.start_mining()
 
-    @staticmethod
-    def exit():
+    def exit(self):
         logging.info('Interrupted...')
+        if self.miner_process:
+            self.miner_process.stop()
+
+    def notify(self) -> None:
+        """ New users' requests are saved to db """
+        (self.miner_process or self.miner).notify()
+
+    def receive_announcement(self, announcement: dict) -> str:
+        return (self.miner_process or self.miner).receive_announcement(announcement)
 
     def mine(self):
         self.miner.main()
 
     def start_mining(self):
-        thread = threading.Thread(daemon=True, target=self.mine)
-        thread.start()
+        threading.Thread(daemon=True, target=self.broadcaster.run).start()
+        if self.miner:
+            threading.Thread(daemon=True, target=self.miner.ingest).start()
+            thread = threading.Thread(daemon=True, target=self.mine)
+            thread.start()
 
     def run(
             self, host: str = '0.0.0.0',
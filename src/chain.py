@@ -1,95 +1,178 @@
 import hashlib
+import itertools
 import json
+import logging
 import threading
-from copy import deepcopy
+from abc import ABC, abstractmethod
 from decimal import Decimal
-from typing import List
+from typing import Callable, Dict, List, Iterable, Set, Tuple
 
+from src import codec, merkle
 from src.db.connector import DatabaseConnector
-from src.utils import actual_time, serialize
+from src.ledger import BalanceLedger
+from src.mempool import Mempool
+from src.pow import MAX_TARGET
+from src.tree import BlockTree
+from src.utils import actual_time, get_env_var
 
 
-class RawTransaction:
-    def __init__(self, amount: str, fee: str, sender: str, recipient: str, timestamp: int = None, lock_script: str = None):
-        self.amount = amount
-        self.sender = sender
-        self.recipient = recipient
-        self.fee = fee
-        self.timestamp = timestamp if timestamp else actual_time()
-        self.lock_script = lock_script
+class Immutable(ABC):
+    """ Compact __slots__ object which can't be changed after creation, the hash is calculated once """
+    __slots__ = ('_hash',)
+
+    def __init__(self, **fields):
+        for name, value in fields.items():
+            object.__setattr__(self, name, value)
+        object.__setattr__(self, '_hash', None)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f'{type(self).__name__} is immutable')
+
+    def __delattr__(self, name):
+        raise AttributeError(f'{type(self).__name__} is immutable')
+
+    @property
+    def fields(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__ if not name.startswith('_')}
 
     @property
     def hash(self) -> str:
-        return hashlib.sha256(
-            json.dumps(
-                self.__dict__, sort_keys=True, default=serialize
-            ).encode()
-        ).hexdigest()
+        if self._hash is None:
+            object.__setattr__(self, '_hash', self.get_hash())
+        return self._hash
+
+    @abstractmethod
+    def get_hash(self) -> str:
+        pass
+
+
+class RawTransaction(Immutable):
+    __slots__ = ('amount', 'sender', 'recipient', 'fee', 'timestamp', 'lock_script')
 
+    def __init__(self, amount: str, fee: str, sender: str, recipient: str, timestamp: int = None, lock_script: str = None):
+        super().__init__(
+            amount=amount,
+            sender=sender,
+            recipient=recipient,
+            fee=fee,
+            timestamp=timestamp if timestamp else actual_time(),
+            lock_script=lock_script,
+        )
+
+    def get_hash(self) -> str:
+        return hashlib.sha256(codec.encode_raw_transaction(self)).hexdigest()
+
+
+class Transaction(Immutable):
+    __slots__ = ('signature', 'public_key', 'raw')
 
-class Transaction:
     def __init__(self, signature: str, public_key: str, raw: RawTransaction):
-        self.signature = signature
-        self.public_key = public_key
-        self.raw = raw
+        super().__init__(signature=signature, public_key=public_key, raw=raw)
+
+    @classmethod
+    def from_request(cls, request: dict) -> 'Transaction':
+        """ Transaction from the user's request (see /send) """
+        return cls(
+            signature=request['signature'],
+            public_key=request['public_key'],
+            raw=RawTransaction(
+                amount=request['amount'],
+                fee=request['fee'],
+                sender=request['sender'],
+                recipient=request['recipient'],
+                timestamp=request['timestamp'],
+                lock_script=request['lock_script'],
+            )
+        )
+
+    @classmethod
+    def from_info(cls, info: dict) -> 'Transaction':
+        """ Transaction from /chain response """
+        return cls(signature=info['signature'], public_key=info['public_key'], raw=RawTransaction(**info['raw']))
 
     @property
-    def header(self):
-        header = deepcopy(self.__dict__)
-        del header['raw']
-        return header
+    def request(self) -> dict:
+        return {**self.header, **self.raw.fields}
 
     @property
-    def hash(self) -> str:
-        return hashlib.sha256(
-            json.dumps(
-                {
-                    'signature': self.signature,
-                    'public_key': self.public_key,
-                    'amount': self.raw.amount,
-                    'fee': self.raw.fee,
-                    'sender': self.raw.sender,
-                    'recipient': self.raw.recipient,
-                    'timestamp': self.raw.timestamp,
-                    'lock_script': self.raw.lock_script,
-                }, sort_keys=True, default=serialize
-            ).encode()
-        ).hexdigest()
+    def header(self):
+        return {'signature': self.signature, 'public_key': self.public_key}
+
+    def get_hash(self) -> str:
+        return hashlib.sha256(codec.encode_transaction(self)).hexdigest()
 
 
-class Block:
+class Block(Immutable):
     MAX_SIZE = 100
 
+    __slots__ = (
+        'transactions', 'index', 'timestamp', 'previous_hash', 'nonce', 'merkle_root', 'target', '_header_prefix',
+    )
+
     def __init__(
             self, index: int,
-            transactions: List[Transaction],
+            transactions: Iterable[Transaction],
             timestamp: int,
             previous_hash: str,
             nonce: int = 0,
+            merkle_root: str = None,
+            target: int = MAX_TARGET,
     ):
-        self.transactions = transactions
+        transactions = tuple(transactions)
+        super().__init__(
+            transactions=transactions,
+            index=index,
+            timestamp=timestamp,
+            previous_hash=previous_hash,
+            nonce=nonce,
+            merkle_root=merkle_root if merkle_root else merkle.get_root([tx.hash for tx in transactions]),
+            target=target,
+            _header_prefix=None,
+        )
 
-        self.index = index
-        self.timestamp = timestamp
-        self.previous_hash = previous_hash
-        self.nonce = nonce
+    @classmethod
+    def from_info(cls, info: dict) -> 'Block':
+        """ Block from /chain response, the hash is calculated again """
+        return cls(
+            index=info['index'],
+            transactions=[Transaction.from_info(transaction) for transaction in info['transactions']],
+            timestamp=info['timestamp'],
+            previous_hash=info['previous_hash'],
+            nonce=info['nonce'],
+            merkle_root=info['merkle_root'],
+            target=info['target'],
+        )
+
+    @classmethod
+    def from_header(cls, header: dict) -> 'Block':
+        """ Block without transactions from /headers response, enough to check the hash and the proof """
+        return cls(
+            index=header['index'],
+            transactions=(),
+            timestamp=header['timestamp'],
+            previous_hash=header['previous_hash'],
+            nonce=header['nonce'],
+            merkle_root=header['merkle_root'],
+            target=header['target'],
+        )
+
+    def replace(self, **fields) -> 'Block':
+        """ Copy of the block with changed fields, e.g. the nonce found by PoW """
+        return Block(**{**self.fields, **fields})
 
     @property
     def info(self):
-        return {**self.__dict__, **{'hash': self.hash}}
+        return {**self.fields, **{'hash': self.hash}}
 
     @property
-    def hash(self) -> str:
-        return hashlib.sha256(
-            json.dumps(
-                {
-                    'index': self.index,
-                    'timestamp': self.timestamp,
-                    'previous_hash': self.previous_hash,
-                    'nonce': self.nonce,
-                }, sort_keys=True, default=serialize
-            ).encode()
-        ).hexdigest()
+    def header_prefix(self) -> bytes:
+        """ Canonical header without nonce, the nonce is appended to it to get the hash """
+        if self._header_prefix is None:
+            object.__setattr__(self, '_header_prefix', codec.encode_header_prefix(self))
+        return self._header_prefix
+
+    def get_hash(self) -> str:
+        return hashlib.sha256(self.header_prefix + codec.encode_nonce(self.nonce)).hexdigest()
 
     @property
     def header(self):
@@ -97,35 +180,180 @@ class Block:
         del header['transactions']
         return header
 
+    def get_merkle_root(self) -> str:
+        return merkle.get_root([transaction.hash for transaction in self.transactions])
+
+    def get_proof(self, tx_hash: str) -> List[dict] or None:
+        hashes = [transaction.hash for transaction in self.transactions]
+        if tx_hash in hashes:
+            return merkle.get_proof(hashes, hashes.index(tx_hash))
+
 
 class Blockchain:
-    difficulty = 4
-    threshold_block_time = 10_000_000  # 10 sec
+    initial_target = 16 ** 60 - 1  # hash starts with 4 zero hex digits
+    threshold_block_time = int(get_env_var('BLOCK_TIME', 10_000)) * 1000  # ms -> µs
+    retarget_window = int(get_env_var('RETARGET_WINDOW', 10))  # blocks
     total_emission = Decimal(1_000_000)
     block_reward = Decimal(1)
+    trust_confirmations = 3
+    snapshot_interval = int(get_env_var('SNAPSHOT_INTERVAL', 100))  # blocks
 
     def __init__(self):
-        self.unconfirmed_transactions: List[Transaction] = []
+        self.mempool = Mempool()
+        self.confirmed: Set[str] = set()
         self.chain: List[Block] = []
         self.db: DatabaseConnector = None
+        self.ledger = BalanceLedger(self.trust_confirmations)
+        self.tree = BlockTree(self.get_block_work)
+        self.listeners: List[Callable[[Block], None]] = []  # called with the new last block
+        self.lock = threading.RLock()
 
     def __len__(self):
         return len(self.chain)
 
     def __add__(self, block: Block):
-        self.chain.append(block)
-        if self.db:
-            self.db.save_block_with_transactions(block)
+        with self.lock:
+            self.tree.add(block)
+            self.chain.append(block)
+            self.confirm(block)
+            if self.db:
+                self.db.save_block_with_transactions(block)
+                if block.index % self.snapshot_interval == 0:
+                    self.save_snapshot()
+            self.prune()
+            self.notify_listeners()
 
     @property
     def blocks(self):
-        self.update_local_chain()
+        """ In-memory chain is the source of truth, every appended block is written through to db """
         return self.chain
 
-    def update_local_chain(self):
-        chain = self.db.replace_local_chain(Transaction, RawTransaction, Block)
-        with threading.Lock():
-            self.chain = chain
+    def update_local_chain(self, tip: Tuple[int, str] = None):
+        """
+        Loads blocks saved to db by another process, only above the last known block if possible.
+        The whole chain is loaded if the new blocks don't follow ours or the chain doesn't contain the tip
+        (index, hash) reported by the other process, e.g. it has switched to a branch with more work but not longer
+        """
+        with self.lock:
+            blocks = self.db.load_chain(Transaction, RawTransaction, Block, start=len(self.chain))
+            if not self.chain:
+                self.restore_snapshot(blocks)
+                chain = blocks
+            else:
+                chain = self.chain + blocks
+                if blocks and blocks[0].previous_hash != self.last_block.hash or tip and (
+                        tip[0] >= len(chain) or chain[tip[0]].hash != tip[1]
+                ):
+                    chain = self.db.load_chain(Transaction, RawTransaction, Block)
+            fork = self.get_fork_index(chain)
+            for block in chain[fork:]:
+                self.tree.add(block)
+            if fork < len(self.chain) or fork < len(chain):
+                self.switch(fork, chain[fork:])
+
+    def notify_listeners(self) -> None:
+        for listener in self.listeners:
+            listener(self.last_block)
+
+    def save_snapshot(self) -> None:
+        """ Ledger and mempool state at the last block, so a restart replays only blocks above it """
+        with self.mempool.lock:
+            pending = [transaction.request for transaction in self.mempool.transactions.values()]
+        self.db.save_snapshot(self.last_block.index, self.last_block.hash, {
+            'ledger': self.ledger.dump(),
+            'mempool': pending,
+        })
+
+    def restore_snapshot(self, chain: List[Block]) -> None:
+        """ Restores the state of the newest snapshot taken on the chain, its blocks are not replayed """
+        for snapshot in self.db.load_snapshots():
+            index = snapshot['block_index']
+            if index < len(chain) and chain[index].hash == snapshot['block_hash']:
+                break
+        else:
+            return
+        self.ledger.restore(snapshot['state']['ledger'])
+        for block in chain[:index + 1]:
+            self.tree.add(block)
+            self.confirmed.update(transaction.hash for transaction in block.transactions)
+        self.chain = chain[:index + 1]
+        for request in snapshot['state']['mempool']:
+            self.mempool.add(Transaction.from_request(request))
+        logging.info(f'State restored from snapshot at block {index}')
+
+    @staticmethod
+    def get_block_work(block: Block) -> int:
+        """ Expected number of hashes to find the block """
+        return 2 ** 256 // (block.target + 1)
+
+    def get_work(self) -> int:
+        return self.tree.get_work(self.last_block.hash) if self.chain else 0
+
+    def is_main(self, block: Block) -> bool:
+        return block.index < len(self.chain) and self.chain[block.index].hash == block.hash
+
+    def get_fork_index(self, chain: List[Block]) -> int:
+        """ Index of the first block differing from the local chain """
+        fork = 0
+        while fork < min(len(self.chain), len(chain)) and self.chain[fork].hash == chain[fork].hash:
+            fork += 1
+        return fork
+
+    def reorganize(self, blocks: List[Block]) -> List[Transaction] or None:
+        """
+        Adds blocks of another branch (e.g. chain of another node) to the block tree
+        and switches to it if it has more cumulative work, only blocks above the common ancestor are replaced.
+        Returns transactions of the reverted blocks missing in the new branch or None if the branch isn't better
+        """
+        with self.lock:
+            for block in blocks:
+                if not self.tree.add(block):
+                    logging.warning(f'Block {block.index} {block.hash} has unknown parent {block.previous_hash}')
+                    return None
+            if not blocks or self.tree.get_work(blocks[-1].hash) <= self.get_work():
+                return None
+            branch = self.tree.get_branch(blocks[-1].hash, self.is_main)
+            fork = branch[0].index
+            if fork < len(self.chain):
+                logging.info(f'Reorganization: {len(self.chain) - fork} blocks reverted, {len(branch)} applied from {fork}')
+            reverted = self.switch(fork, branch)
+            if self.db:
+                self.db.reorganize(fork, branch)
+                if any(block.index % self.snapshot_interval == 0 for block in branch):
+                    self.save_snapshot()
+            self.notify_listeners()
+            return [
+                transaction for block in reverted for transaction in block.transactions
+                if transaction.signature != '0' and not self.is_confirmed(transaction)  # rewards aren't returned
+            ]
+
+    def switch(self, fork: int, branch: List[Block]) -> List[Block]:
+        """
+        Rolls back blocks from the fork index, confirms blocks of the branch and returns reverted blocks.
+        The new chain is assigned at once, readers without the lock see either the old or the new chain
+        """
+        reverted = self.chain[fork:]
+        for block in reversed(reverted):
+            self.ledger.revert(block, self.chain)
+            self.confirmed.difference_update(transaction.hash for transaction in block.transactions)
+        for block in branch:
+            self.confirm(block)
+        self.chain = self.chain[:fork] + branch
+        self.prune()
+        return reverted
+
+    def prune(self) -> None:
+        """ Side branches deeper than BlockTree.KEEP_DEPTH are removed from the block tree """
+        if self.chain:
+            self.tree.prune(self.last_block.index - BlockTree.KEEP_DEPTH, self.is_main)
+
+    def confirm(self, block: Block) -> None:
+        self.ledger.apply(block)
+        self.mempool.remove(block.transactions)
+        self.confirmed.update(transaction.hash for transaction in block.transactions)
+
+    def is_confirmed(self, transaction: Transaction) -> bool:
+        return transaction.hash in self.confirmed
 
     def create_initial_block(self) -> Block:
         block = Block(
@@ -133,6 +361,7 @@ class Blockchain:
             transactions=[self._create_initial_transaction()],
             timestamp=actual_time(),
             previous_hash='0',
+            target=self.initial_target,
         )
         self + block
         return block
@@ -165,13 +394,58 @@ class Blockchain:
             raw=raw_transaction,
         )
 
+    def get_proof(self, tx_hash: str) -> dict or None:
+        """
+        Merkle inclusion proof of the transaction in the block containing it,
+        the block is found by the transactions hash index of the db (chains without db are scanned)
+        """
+        if tx_hash not in self.confirmed:
+            return None
+        chain = self.chain
+        info = self.db.get_transaction(tx_hash) if self.db else None
+        indexed = [chain[info['block_index']]] if info and info['block_index'] < len(chain) else []
+        for block in itertools.chain(indexed, reversed(chain)):  # the chain is scanned without db or if it's stale
+            proof = block.get_proof(tx_hash)
+            if proof is not None:
+                return {
+                    'tx_hash': tx_hash,
+                    'block_index': block.index,
+                    'block_hash': block.hash,
+                    'merkle_root': block.merkle_root,
+                    'proof': proof,
+                }
+
     @property
     def last_block(self) -> Block:
         return self.chain[-1]
 
-    def edit_difficulty(self) -> None:
-        is_long_calculation = (actual_time() - self.last_block.timestamp) < self.threshold_block_time
-        self.difficulty += (-1, 1)[int(is_long_calculation)]
+    def get_window(self, parent: Block, pending: Dict[str, Block] = None) -> List[Block]:
+        """ Last `retarget_window` + 1 blocks of the parent's branch, `pending` blocks aren't in the block tree yet """
+        window = [parent]
+        while len(window) <= self.retarget_window and window[-1].index:
+            block = window[-1]
+            if self.is_main(block):
+                window += reversed(self.chain[max(block.index - self.retarget_window - 1 + len(window), 0):block.index])
+                break
+            previous = self.tree.get(block.previous_hash) or (pending or {}).get(block.previous_hash)
+            if previous is None:
+                break
+            window.append(previous)
+        return window[::-1]
+
+    def get_next_target(self, parent: Block, pending: Dict[str, Block] = None) -> int:
+        """
+        Target of the block following the parent: hashrate is estimated by the work and the time span of the window
+        (see get_window), so the next block takes `threshold_block_time` on average.
+        The time span is limited to 1/4..4 of the expected one, so the target changes 4 times at most per block
+        """
+        window = self.get_window(parent, pending)
+        if len(window) < 2:
+            return parent.target
+        work = sum(self.get_block_work(block) for block in window[1:])
+        expected = (len(window) - 1) * self.threshold_block_time
+        actual = min(max(window[-1].timestamp - window[0].timestamp, expected // 4), expected * 4)
+        return min(max(2 ** 256 * actual // (work * self.threshold_block_time) - 1, 1), MAX_TARGET)
 
     @staticmethod
     def get_hash(block: dict) -> str:
@@ -0,0 +1,249 @@
+""" Versioned length-prefixed binary encoding used for hashing and node-to-node transfer """
+import struct
+from typing import Iterator, List
+
+VERSION = 1  # of transactions, their hashes and signed messages depend on it
+HEADER_VERSION = 2  # of block headers, 2: 256-bit target
+CONTENT_TYPE = 'application/x-pycoin'
+
+CHAIN = 1
+REQUESTS = 2
+BLOCK = 3
+_VERSIONS = {CHAIN: HEADER_VERSION, REQUESTS: VERSION, BLOCK: HEADER_VERSION}  # payloads with blocks follow the header
+
+NONCE_SIZE = 8
+MAX_NONCE = 2 ** 63 - 1  # stored as a signed 64-bit integer
+TARGET_SIZE = 32
+_NONE = 0xFFFFFFFF
+_LENGTH = struct.Struct('>I')
+_INT = struct.Struct('>q')
+_NONCE = struct.Struct('>Q')
+
+
+class EncodeError(ValueError):
+    pass
+
+
+class DecodeError(ValueError):
+    pass
+
+
+def pack_str(value: str or None) -> bytes:
+    """ Only strings are encoded, so values of other types (e.g. the amount 1 and "1") can't share a hash """
+    if value is None:
+        return _LENGTH.pack(_NONE)
+    if not isinstance(value, str):
+        raise EncodeError(f'Invalid string {value!r}')
+    encoded = value.encode()
+    return _LENGTH.pack(len(encoded)) + encoded
+
+
+def pack_int(value: int) -> bytes:
+    try:
+        return _INT.pack(value)
+    except struct.error as e:
+        raise EncodeError(f'Invalid integer {value!r}: {e}')
+
+
+def encode_nonce(nonce: int) -> bytes:
+    try:
+        if nonce > MAX_NONCE:
+            raise struct.error(f'exceeds {MAX_NONCE}')
+        return _NONCE.pack(nonce)
+    except (struct.error, TypeError) as e:
+        raise EncodeError(f'Invalid nonce {nonce!r}: {e}')
+
+
+def pack_target(target: int) -> bytes:
+    try:
+        return target.to_bytes(TARGET_SIZE, 'big')
+    except (OverflowError, AttributeError) as e:
+        raise EncodeError(f'Invalid target {target}: {e}')
+
+
+def _raw_transaction_body(raw) -> bytes:
+    return b''.join((
+        pack_str(raw.amount),
+        pack_str(raw.fee),
+        pack_str(raw.sender),
+        pack_str(raw.recipient),
+        pack_int(raw.timestamp),
+        pack_str(raw.lock_script),
+    ))
+
+
+def _transaction_body(transaction) -> bytes:
+    return pack_str(transaction.signature) + pack_str(transaction.public_key) + _raw_transaction_body(transaction.raw)
+
+
+def encode_raw_transaction(raw) -> bytes:
+    return bytes((VERSION,)) + _raw_transaction_body(raw)
+
+
+def encode_transaction(transaction) -> bytes:
+    return bytes((VERSION,)) + _transaction_body(transaction)
+
+
+def encode_header_prefix(block) -> bytes:
+    """ Block header without nonce, nonce is appended as NONCE_SIZE big-endian bytes """
+    return b''.join((
+        bytes((HEADER_VERSION,)),
+        pack_int(block.index),
+        pack_int(block.timestamp),
+        pack_str(block.previous_hash),
+        pack_str(block.merkle_root),
+        pack_target(block.target),
+    ))
+
+
+class Reader:
+    """ Reads from a buffer (bytes, bytearray, memoryview) at an offset, only the read values are copied """
+    def __init__(self, data, offset: int = 0):
+        self.data = data
+        self.offset = offset
+
+    def take(self, size: int) -> bytes:
+        end = self.offset + size
+        if end > len(self.data):
+            raise DecodeError('Unexpected end of data')
+        chunk = self.data[self.offset:end]
+        self.offset = end
+        return chunk
+
+    def unpack(self, layout: struct.Struct):
+        try:
+            value, = layout.unpack_from(self.data, self.offset)
+        except struct.error:
+            raise DecodeError('Unexpected end of data')
+        self.offset += layout.size
+        return value
+
+    def read_length(self) -> int:
+        return self.unpack(_LENGTH)
+
+    def read_str(self) -> str or None:
+        length = self.unpack(_LENGTH)
+        if length == _NONE:
+            return None
+        try:
+            return self.take(length).decode()
+        except UnicodeDecodeError as e:
+            raise DecodeError(f'Invalid string: {e}')
+
+    def read_int(self) -> int:
+        return self.unpack(_INT)
+
+    def read_nonce(self) -> int:
+        nonce = self.unpack(_NONCE)
+        if nonce > MAX_NONCE:
+            raise DecodeError(f'Nonce {nonce} exceeds {MAX_NONCE}')
+        return nonce
+
+    def read_target(self) -> int:
+        return int.from_bytes(self.take(TARGET_SIZE), 'big')
+
+    def read_raw_transaction(self) -> dict:
+        return {
+            'amount': self.read_str(),
+            'fee': self.read_str(),
+            'sender': self.read_str(),
+            'recipient': self.read_str(),
+            'timestamp': self.read_int(),
+            'lock_script': self.read_str(),
+        }
+
+    def read_transaction(self) -> dict:
+        return {'signature': self.read_str(), 'public_key': self.read_str(), 'raw': self.read_raw_transaction()}
+
+    def read_block(self) -> dict:
+        block = {
+            'index': self.read_int(),
+            'timestamp': self.read_int(),
+            'previous_hash': self.read_str(),
+            'merkle_root': self.read_str(),
+            'target': self.read_target(),
+            'nonce': self.read_nonce(),
+            'hash': self.read_str(),
+        }
+        block['transactions'] = [self.read_transaction() for _ in range(self.read_length())]
+        return block
+
+
+def _header(kind: int) -> bytes:
+    return bytes((_VERSIONS[kind], kind))
+
+
+def _block_body(block) -> bytes:
+    return b''.join((
+        encode_header_prefix(block)[1:],
+        encode_nonce(block.nonce),
+        pack_str(block.hash),
+        _LENGTH.pack(len(block.transactions)),
+        *(_transaction_body(transaction) for transaction in block.transactions),
+    ))
+
+
+def dumps_block(block) -> bytes:
+    """ Binary equivalent of block.info """
+    return _header(BLOCK) + _block_body(block)
+
+
+def iter_chain(blocks: list, page_size: int = 100) -> Iterator[bytes]:
+    """ dumps_chain by pages of blocks, to stream large chains """
+    yield _header(CHAIN) + _LENGTH.pack(len(blocks))
+    for start in range(0, len(blocks), page_size):
+        yield b''.join(_block_body(block) for block in blocks[start:start + page_size])
+
+
+def dumps_chain(blocks: list) -> bytes:
+    """ Binary equivalent of /chain response {'len': ..., 'blocks': [block.info, ...]} """
+    return b''.join(iter_chain(blocks))
+
+
+def _load_chain(reader: Reader) -> dict:
+    blocks = [reader.read_block() for _ in range(reader.read_length())]
+    return {'len': len(blocks), 'blocks': blocks}
+
+
+def dumps_requests(requests: List[dict]) -> bytes:
+    """ Binary equivalent of a list of users' transaction requests (see /send) """
+    parts = [_header(REQUESTS), _LENGTH.pack(len(requests))]
+    try:
+        for request in requests:
+            parts.append(pack_str(request['signature']))
+            parts.append(pack_str(request['public_key']))
+            parts.append(pack_str(request['amount']))
+            parts.append(pack_str(request['fee']))
+            parts.append(pack_str(request['sender']))
+            parts.append(pack_str(request['recipient']))
+            parts.append(pack_int(request['timestamp']))
+            parts.append(pack_str(request.get('lock_script')))
+    except (KeyError, TypeError, AttributeError, struct.error) as e:
+        raise EncodeError(f'Malformed request: {e}')
+    return b''.join(parts)
+
+
+def _load_requests(reader: Reader) -> List[dict]:
+    requests = []
+    for _ in range(reader.read_length()):
+        request = {'signature': reader.read_str(), 'public_key': reader.read_str()}
+        request.update(reader.read_raw_transaction())
+        requests.append(request)
+    return requests
+
+
+_LOADERS = {
+    CHAIN: _load_chain,
+    REQUESTS: _load_requests,
+    BLOCK: Reader.read_block,
+}
+
+
+def loads(data: bytes, offset: int = 0):
+    reader = Reader(data, offset)
+    version, kind = reader.take(2)
+    if kind not in _LOADERS:
+        raise DecodeError(f'Unknown payload kind {kind}')
+    if version != _VERSIONS[kind]:
+        raise DecodeError(f'Unsupported version {version} of payload kind {kind}')
+    return _LOADERS[kind](reader)
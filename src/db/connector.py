@@ -1,16 +1,19 @@
+import heapq
+import itertools
 import json
 import logging
 import os
 import traceback
-from typing import List
+from typing import List, Tuple
 from contextlib import contextmanager
-from copy import deepcopy
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, insert, inspect, select, tuple_
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy.orm import scoped_session, sessionmaker
+from sqlalchemy.orm import scoped_session, sessionmaker, selectinload
 
 from src.db.models import *
+from src.db.segments import SegmentStore
+from src.utils import get_env_var
 
 
 def save(func):
@@ -32,6 +35,11 @@ def save(func):
 
 
 class DatabaseConnector:
+    # WAL lets readers and the miner's writes proceed concurrently, NORMAL syncs on checkpoints only
+    PRAGMAS = {
+        'journal_mode': get_env_var('SQLITE_JOURNAL_MODE', 'WAL'),
+        'synchronous': get_env_var('SQLITE_SYNCHRONOUS', 'NORMAL'),
+    }
 
     def __init__(self, drop_and_create: bool = False, debug: bool = False):
         self.engine = create_engine(
@@ -39,18 +47,34 @@ class DatabaseConnector:
             connect_args={'check_same_thread': False, 'timeout': 15},
             echo=debug
         )
+        event.listen(self.engine, 'connect', self.set_pragmas)
         self.engine.connect()
+        self.Session = scoped_session(sessionmaker(bind=self.engine, autoflush=False))
         self.metadata = Base.metadata
         if drop_and_create:
             self.recreate_tables()
+        else:
+            self.migrate()
+            self.create_all_tables()
+        self.segments = None  # blocks are stored in sql tables
+        if get_env_var('CHAIN_STORE', 'sql') == 'segments':
+            self.segments = SegmentStore(f'{os.getenv("ADDRESS")}.segments', drop=drop_and_create)
+
+    @classmethod
+    def set_pragmas(cls, connection, _):
+        cursor = connection.cursor()
+        for pragma, value in cls.PRAGMAS.items():
+            cursor.execute(f'PRAGMA {pragma}={value}')
+        cursor.close()
 
     @contextmanager
     def session(self):
-        Session = scoped_session(sessionmaker(bind=self.engine, autoflush=False))
-        session = Session()
-        yield session
-        self.commit(session)
-        Session.remove()
+        session = self.Session()
+        try:
+            yield session
+            self.commit(session)
+        finally:
+            self.Session.remove()
 
     @staticmethod
     def commit(session):
@@ -59,6 +83,20 @@ class DatabaseConnector:
         except IntegrityError:
             session.rollback()
 
+    def migrate(self):
+        """
+        Blocks stored before the header had the target (codec.HEADER_VERSION 2) don't match their hashes any more,
+        the chain tables are recreated and the chain is synchronized from other nodes, users' requests are kept
+        """
+        inspector = inspect(self.engine)
+        if not inspector.has_table(BlockModel.__tablename__):
+            return
+        if 'target' not in {column['name'] for column in inspector.get_columns(BlockModel.__tablename__)}:
+            logging.warning('Stored chain has blocks without target, it is dropped')
+            self.metadata.drop_all(self.engine, tables=[
+                model.__table__ for model in (TransactionModel, BlockModel, SnapshotModel)
+            ])
+
     def recreate_tables(self):
         self.drop_all_tables()
         self.create_all_tables()
@@ -87,58 +125,62 @@ class DatabaseConnector:
     def get_all(self, session, *entities) -> List[BlockModel]:
         return self.query(session, *entities).all()
 
-    def _add_block(self, session, **kwargs) -> BlockModel:
-        return self.add(session, BlockModel(**kwargs))
-
-    def _add_transaction(self, session, **kwargs) -> TransactionModel:
-        return self.add(session, TransactionModel(**kwargs))
-
     def save_user_request(self, request):
         with self.session() as session:
             return self.add(session, UserRequest(request=json.dumps(request)))
 
+    def save_user_requests(self, requests: List[dict]):
+        with self.session() as session:
+            session.add_all([UserRequest(request=json.dumps(request)) for request in requests])
+
+    @staticmethod
+    def _save_blocks(session, blocks: list):
+        """ Bulk inserts (executemany) of blocks and their transactions """
+        session.execute(insert(BlockModel), [{**block.header, 'target': f'{block.target:064x}'} for block in blocks])
+        transactions = [
+            {
+                **transaction.header,
+                **transaction.raw.fields,
+                'block_index': block.index,
+                'hash': transaction.hash,
+            } for block in blocks for transaction in block.transactions
+        ]
+        if transactions:
+            session.execute(insert(TransactionModel), transactions)
+
     def save_block_with_transactions(self, block):
+        """ Block and its transactions are saved in one transaction """
+        if self.segments is not None:
+            return self.segments.append([block])
         with self.session() as session:
-            self._add_block(session, **block.header)
-            for transaction in block.transactions:
-                self._add_transaction(
-                    session, **{
-                        **transaction.header,
-                        **transaction.raw.__dict__,
-                        'block_index': block.index,
-                        'hash': transaction.hash,
-                    })
-
-    def replace_chain(self, chain: dict):
+            try:
+                self._save_blocks(session, [block])
+            except IntegrityError:
+                logging.error(traceback.format_exc())
+                session.rollback()
+
+    def reorganize(self, fork: int, blocks: list):
+        """ Blocks from the fork index are replaced by another branch in one transaction """
+        if self.segments is not None:
+            self.segments.truncate(fork)
+            return self.segments.append(blocks)
         with self.session() as session:
-            self.query(session, BlockModel).delete()
-            self.query(session, TransactionModel).delete()
-            for block in chain['blocks']:
-                db_block = deepcopy(block)
-                del db_block['transactions']
-                self._add_block(session, **db_block)
-                for transaction in block['transactions']:
-                    self._add_transaction(
-                        session, **{
-                            'signature': transaction['signature'],
-                            'public_key': transaction['public_key'],
-                            'sender': transaction['raw']['sender'],
-                            'recipient': transaction['raw']['recipient'],
-                            'amount': transaction['raw']['amount'],
-                            'fee': transaction['raw']['fee'],
-                            'lock_script': transaction['raw']['lock_script'],
-                            'timestamp': transaction['raw']['timestamp'],
-                            'hash': '0',
-                            'block_index': block['index'],
-                    })
-
-    def replace_local_chain(self, Transaction, RawTransaction, Block):
-        chain = []
+            self.query(session, TransactionModel).filter(TransactionModel.block_index >= fork).delete()
+            self.query(session, BlockModel).filter(BlockModel.index >= fork).delete()
+            if blocks:
+                self._save_blocks(session, blocks)
+
+    def load_chain(self, Transaction, RawTransaction, Block, start: int = 0) -> list:
+        """ Blocks from the start index with eagerly loaded transactions """
+        if self.segments is not None:
+            return [Block.from_info(info) for info in self.segments.load(start)]
         with self.session() as session:
-            db_blocks = self.get_all(session, BlockModel)
-            logging.info(f'Blocks updating: {len(db_blocks)}')
-            for db_block in db_blocks:
-                chain.append(Block(
+            db_blocks = self.query(session, BlockModel).filter(
+                BlockModel.index >= start
+            ).order_by(BlockModel.index).options(selectinload(BlockModel.transactions)).all()
+            logging.info(f'Blocks loaded: {len(db_blocks)} (from {start})')
+            return [
+                Block(
                     index=db_block.index,
                     transactions=[
                         Transaction(
@@ -157,13 +199,105 @@ class DatabaseConnector:
                     timestamp=db_block.timestamp,
                     previous_hash=db_block.previous_hash,
                     nonce=db_block.nonce,
-                ))
-            return chain
+                    merkle_root=db_block.merkle_root,
+                    target=int(db_block.target, 16),
+                ) for db_block in db_blocks
+            ]
+
+    @staticmethod
+    def parse_cursor(cursor: str) -> Tuple[int, int]:
+        """ Cursor of the history page is "<block index>:<position>", position depends on the chain store """
+        block_index, position = cursor.split(':')
+        return int(block_index), int(position)
+
+    @staticmethod
+    def _transaction_info(tx: TransactionModel) -> dict:
+        return {
+            'hash': tx.hash,
+            'block_index': tx.block_index,
+            'signature': tx.signature,
+            'public_key': tx.public_key,
+            'amount': tx.amount,
+            'fee': tx.fee,
+            'sender': tx.sender,
+            'recipient': tx.recipient,
+            'timestamp': tx.timestamp,
+            'lock_script': tx.lock_script,
+        }
+
+    def get_transaction(self, tx_hash: str) -> dict or None:
+        """ Confirmed transaction by hash with the index of its block """
+        if self.segments is not None:
+            return self.segments.get_transaction(tx_hash)
+        with self.session() as session:
+            tx = self.query(session, TransactionModel).filter(
+                TransactionModel.hash == tx_hash
+            ).order_by(TransactionModel.id).first()
+            return self._transaction_info(tx) if tx else None
+
+    def get_history(self, address: str, cursor: str = None, limit: int = 50) -> Tuple[List[dict], str or None]:
+        """
+        Transactions sent or received by the address from the newest one, keyset paginated:
+        the page starts after the cursor, the cursor of the next page is returned if there are more transactions
+        """
+        key = self.parse_cursor(cursor) if cursor else None
+        if self.segments is not None:
+            page = self.segments.get_history(address, key, limit + 1)
+        else:
+            page = self._get_history(address, key, limit + 1)
+        next_cursor = None
+        if len(page) > limit:
+            block_index, position = page[limit - 1][0]
+            next_cursor = f'{block_index}:{position}'
+        return [info for _, info in page[:limit]], next_cursor
+
+    def _get_history(self, address: str, key: Tuple[int, int] or None, limit: int) -> List[Tuple[Tuple[int, int], dict]]:
+        """ Sent and received transactions are queried by their (address, block_index) indexes and merged """
+        with self.session() as session:
+            pages = []
+            for column in (TransactionModel.sender, TransactionModel.recipient):
+                query = self.query(session, TransactionModel).filter(column == address)
+                if key:
+                    query = query.filter(tuple_(TransactionModel.block_index, TransactionModel.id) < key)
+                pages.append(query.order_by(
+                    TransactionModel.block_index.desc(), TransactionModel.id.desc()
+                ).limit(limit).all())
+            merged = heapq.merge(*pages, key=lambda tx: (tx.block_index, tx.id), reverse=True)
+            unique = (tx for tx, _ in itertools.groupby(merged))  # sent to itself
+            return [((tx.block_index, tx.id), self._transaction_info(tx)) for tx in itertools.islice(unique, limit)]
+
+    def save_snapshot(self, block_index: int, block_hash: str, state: dict, keep: int = 2):
+        """ State at the block, only the newest `keep` snapshots are kept """
+        with self.session() as session:
+            self.add(session, SnapshotModel(block_index=block_index, block_hash=block_hash, state=json.dumps(state)))
+            kept = self.query(session, SnapshotModel.id).order_by(SnapshotModel.id.desc()).limit(keep).subquery()
+            self.query(session, SnapshotModel).filter(
+                SnapshotModel.id.not_in(select(kept.c.id))
+            ).delete(synchronize_session=False)
+
+    def load_snapshots(self) -> List[dict]:
+        """ Snapshots from the newest """
+        with self.session() as session:
+            return [
+                {'block_index': snapshot.block_index, 'block_hash': snapshot.block_hash, 'state': json.loads(snapshot.state)}
+                for snapshot in self.query(session, SnapshotModel).order_by(SnapshotModel.id.desc()).all()
+            ]
 
-    def get_unseen_requests(self):
+    def get_unseen_requests(self, limit: int = 1000) -> List[Tuple[int, str]]:
+        """
+        Ids and bodies of up to `limit` oldest unseen requests,
+        they are marked as viewed by mark_requests_checked once processed
+        """
         with self.session() as session:
-            return self.query(session, UserRequest).filter(~UserRequest.checked)
+            requests = self.query(session, UserRequest).filter(
+                ~UserRequest.checked
+            ).order_by(UserRequest.id).limit(limit).all()
+            return [(request.id, request.request) for request in requests]
 
-    def mark_requests_as_viewed(self, data):
+    def mark_requests_checked(self, request_ids: List[int]) -> None:
+        if not request_ids:
+            return
         with self.session() as session:
-            self.query(session, UserRequest).filter(UserRequest.id == data.id).update({UserRequest.checked: 1})
+            self.query(session, UserRequest).filter(
+                UserRequest.id.in_(request_ids)
+            ).update({UserRequest.checked: 1}, synchronize_session=False)
@@ -1,6 +1,6 @@
 from sqlalchemy import (
     Column, Integer, String,
-    ForeignKeyConstraint, Text,
+    ForeignKeyConstraint, Index, Text,
 )
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
@@ -16,8 +16,10 @@ class BlockModel(Base):
     hash = Column(String(64), nullable=False, unique=True, index=True)
     previous_hash = Column(String(64), nullable=False, unique=True)
     nonce = Column(Integer, nullable=False)
+    merkle_root = Column(String(64), nullable=False)
+    target = Column(String(64), nullable=False)  # hex, exceeds sqlite integer
 
-    transactions = relationship('TransactionModel', back_populates='block')
+    transactions = relationship('TransactionModel', back_populates='block', order_by='TransactionModel.id')
 
 
 class TransactionModel(Base):
@@ -41,6 +43,8 @@ class TransactionModel(Base):
 
     __table_args__ = (
         ForeignKeyConstraint(('block_index',), ('blocks.index',)),
+        Index('ix_transactions_sender_block_index', 'sender', 'block_index'),
+        Index('ix_transactions_recipient_block_index', 'recipient', 'block_index'),
     )
 
 
@@ -50,3 +54,12 @@ class UserRequest(Base):
     id = Column(Integer, nullable=False, unique=True, primary_key=True, autoincrement=True)
     request = Column(String, nullable=False)
     checked = Column(Integer, default=0, index=True)
+
+
+class SnapshotModel(Base):
+    __tablename__ = 'snapshots'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    block_index = Column(Integer, nullable=False)
+    block_hash = Column(String(64), nullable=False)
+    state = Column(Text, nullable=False)
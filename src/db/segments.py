@@ -0,0 +1,220 @@
+import bisect
+import hashlib
+import logging
+import os
+import shutil
+import struct
+import threading
+from collections import defaultdict
+from typing import BinaryIO, Dict, List, Tuple
+
+from src import codec
+from src.utils import get_env_var
+
+
+class IndexReader(codec.Reader):
+    """ Collects hashes of the read transactions, a transaction is hashed as encoded (see codec.encode_transaction) """
+    def __init__(self, data, offset: int = 0):
+        super().__init__(data, offset)
+        self.hashes = []
+
+    def read_transaction(self) -> dict:
+        start = self.offset
+        transaction = super().read_transaction()
+        self.hashes.append(hashlib.sha256(bytes((codec.VERSION,)) + self.data[start:self.offset]).hexdigest())
+        return transaction
+
+
+class SegmentStore:
+    """
+    Append-only block store: encoded blocks (see codec.dumps_block) are written one after another to segment files,
+    the index file keeps (segment, offset, length, hash) of every block by height.
+    Only the tail above a fork point is truncated on reorganization. Blocks are read by position, not mapped:
+    the miner process may truncate a segment the API process reads, a short read fails while a mapping would crash.
+    """
+    INDEX_ENTRY = struct.Struct('>IQI32s')  # segment, offset, length, block hash
+    INDEX_FILE = 'index'
+
+    def __init__(self, path: str, segment_size: int = None, drop: bool = False):
+        self.path = path
+        self.segment_size = segment_size if segment_size else int(get_env_var('SEGMENT_SIZE', 64 * 1024 * 1024))
+        self.entries: List[Tuple[int, int, int, str]] = []
+        self.transactions: Dict[str, Tuple[int, int]] = {}  # hash -> (height, position in block)
+        self.block_transactions: List[List[str]] = []
+        self.addresses: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+        self.files: Dict[int, BinaryIO] = {}
+        self.lock = threading.RLock()
+        if not drop and self.get_version() not in (None, codec.HEADER_VERSION):
+            logging.warning(f'Segments of header version {self.get_version()} are dropped')
+            drop = True
+        if drop:
+            shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(path, exist_ok=True)
+        self.refresh()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get_segment_path(self, segment: int) -> str:
+        return os.path.join(self.path, f'{segment:08d}.seg')
+
+    def get_version(self) -> int or None:
+        """ Header version of the stored blocks (see codec.HEADER_VERSION), None if there are none """
+        if not os.path.exists(self.get_segment_path(0)):
+            return None
+        with open(self.get_segment_path(0), 'rb') as file:
+            version = file.read(1)
+        return version[0] if version else None
+
+    @property
+    def index_path(self) -> str:
+        return os.path.join(self.path, self.INDEX_FILE)
+
+    def _read_entry(self, data: bytes, offset: int = 0) -> Tuple[int, int, int, str]:
+        segment, block_offset, length, block_hash = self.INDEX_ENTRY.unpack_from(data, offset)
+        return segment, block_offset, length, block_hash.hex()
+
+    def refresh(self) -> None:
+        """ Reads index entries appended by another process, all entries are reloaded if the tail was replaced """
+        with self.lock:
+            with open(self.index_path, 'ab+') as file:
+                file.seek(0, os.SEEK_END)
+                size = file.tell()
+                known = len(self.entries) * self.INDEX_ENTRY.size
+                if self.entries and size >= known:
+                    file.seek(known - self.INDEX_ENTRY.size)
+                    if self._read_entry(file.read(self.INDEX_ENTRY.size)) != self.entries[-1]:
+                        known = 0
+                if size < known or not known:
+                    self.entries, known = [], 0
+                    self.transactions, self.block_transactions, self.addresses = {}, [], defaultdict(list)
+                    self.close()
+                file.seek(known)
+                data = file.read(size - known)
+            for offset in range(0, len(data) - self.INDEX_ENTRY.size + 1, self.INDEX_ENTRY.size):
+                entry = self._read_entry(data, offset)
+                segment, block_offset, length, block_hash = entry
+                try:
+                    reader = IndexReader(self.read_data(segment, block_offset, length), 2)  # version, kind
+                    info = reader.read_block()
+                except (FileNotFoundError, codec.DecodeError):
+                    logging.error(f'Block {len(self.entries)} is missing in segment {segment}, index is truncated')
+                    with open(self.index_path, 'ab') as file:
+                        file.truncate(len(self.entries) * self.INDEX_ENTRY.size)
+                    break
+                self._add_entry(entry, [
+                    (tx_hash, transaction['raw']['sender'], transaction['raw']['recipient'])
+                    for tx_hash, transaction in zip(reader.hashes, info['transactions'])
+                ])
+
+    def _add_entry(self, entry: Tuple[int, int, int, str], transactions: List[Tuple[str, str, str]]) -> None:
+        """ Block and its (hash, sender, recipient) transactions are indexed """
+        height = len(self.entries)
+        self.entries.append(entry)
+        self.block_transactions.append([tx_hash for tx_hash, _, _ in transactions])
+        for position, (tx_hash, sender, recipient) in enumerate(transactions):
+            self.transactions.setdefault(tx_hash, (height, position))
+            for address in {sender, recipient}:
+                self.addresses[address].append((height, position))
+
+    def append(self, blocks: list) -> None:
+        with self.lock:
+            for block in blocks:
+                if block.index != len(self.entries):
+                    logging.error(f'Block {block.index} is not next to the stored chain of {len(self.entries)} blocks')
+                    return
+                data = codec.dumps_block(block)
+                segment, offset = (self.entries[-1][0], self.entries[-1][1] + self.entries[-1][2]) \
+                    if self.entries else (0, 0)
+                if offset and offset + len(data) > self.segment_size:
+                    segment, offset = segment + 1, 0
+                with open(self.get_segment_path(segment), 'ab') as file:
+                    file.truncate(offset)  # drops a partially written block if any
+                    file.write(data)
+                with open(self.index_path, 'ab') as file:
+                    file.truncate(len(self.entries) * self.INDEX_ENTRY.size)
+                    file.write(self.INDEX_ENTRY.pack(segment, offset, len(data), bytes.fromhex(block.hash)))
+                self._add_entry((segment, offset, len(data), block.hash), [
+                    (transaction.hash, transaction.raw.sender, transaction.raw.recipient)
+                    for transaction in block.transactions
+                ])
+
+    def truncate(self, height: int) -> None:
+        """ Removes blocks from the height """
+        with self.lock:
+            if height >= len(self.entries):
+                return
+            segment, offset, _, _ = self.entries[height]
+            for number in [number for number in self.files if number >= segment]:
+                self.files.pop(number).close()
+            with open(self.get_segment_path(segment), 'ab') as file:
+                file.truncate(offset)
+            next_segment = segment + 1
+            while os.path.exists(self.get_segment_path(next_segment)):
+                os.remove(self.get_segment_path(next_segment))
+                next_segment += 1
+            with open(self.index_path, 'ab') as file:
+                file.truncate(height * self.INDEX_ENTRY.size)
+            for tx_hashes in self.block_transactions[height:]:
+                for tx_hash in tx_hashes:
+                    if self.transactions.get(tx_hash, (height,))[0] >= height:
+                        del self.transactions[tx_hash]
+            for positions in self.addresses.values():
+                del positions[bisect.bisect_left(positions, (height, 0)):]
+            del self.entries[height:]
+            del self.block_transactions[height:]
+
+    def read_data(self, segment: int, offset: int, length: int) -> bytes:
+        """ Encoded block from the segment, the segment is truncated if there are fewer bytes """
+        file = self.files.get(segment)
+        if file is None:
+            file = self.files[segment] = open(self.get_segment_path(segment), 'rb', buffering=0)  # reads see truncation
+        file.seek(offset)
+        data = file.read(length)
+        if len(data) < length:
+            raise codec.DecodeError(f'Segment {segment} ends at {offset + len(data)}, block ends at {offset + length}')
+        return data
+
+    def read(self, height: int) -> dict:
+        """ Block info by height """
+        with self.lock:
+            segment, offset, length, _ = self.entries[height]
+            return codec.loads(self.read_data(segment, offset, length))
+
+    def get_transaction_info(self, height: int, position: int) -> dict:
+        transaction = self.read(height)['transactions'][position]
+        return {
+            'hash': self.block_transactions[height][position],
+            'block_index': height,
+            'signature': transaction['signature'],
+            'public_key': transaction['public_key'],
+            **transaction['raw'],
+        }
+
+    def get_transaction(self, tx_hash: str) -> dict or None:
+        with self.lock:
+            self.refresh()
+            if tx_hash in self.transactions:
+                return self.get_transaction_info(*self.transactions[tx_hash])
+
+    def get_history(self, address: str, key: Tuple[int, int] or None, limit: int) -> List[Tuple[Tuple[int, int], dict]]:
+        """ Transactions of the address before the (height, position) key from the newest one """
+        with self.lock:
+            self.refresh()
+            positions = self.addresses.get(address, [])
+            end = bisect.bisect_left(positions, key) if key else len(positions)
+            return [
+                (position, self.get_transaction_info(*position))
+                for position in reversed(positions[max(0, end - limit):end])
+            ]
+
+    def load(self, start: int = 0) -> List[dict]:
+        with self.lock:
+            self.refresh()
+            return [self.read(height) for height in range(start, len(self.entries))]
+
+    def close(self) -> None:
+        with self.lock:
+            for file in self.files.values():
+                file.close()
+            self.files.clear()
@@ -0,0 +1,50 @@
+import threading
+import zlib
+from typing import Dict, Iterator, List, Tuple
+
+from src import codec
+from src.utils import get_env_var, response
+
+
+def compress(chunks: Iterator[bytes], level: int = 6) -> Iterator[bytes]:
+    """ Gzip stream of the chunks """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+class ChainCache:
+    """
+    Serialized /chain bodies (json or binary, gzip or identity) keyed by the last block hash,
+    chains longer than `max_blocks` are not cached but streamed page by page to keep the memory flat.
+    """
+    PAGE_SIZE = 100  # blocks
+
+    def __init__(self, max_blocks: int = None):
+        self.max_blocks = max_blocks if max_blocks else int(get_env_var('CHAIN_CACHE_BLOCKS', 1000))
+        self.tip = None
+        self.bodies: Dict[Tuple[bool, bool], bytes] = {}
+        self.lock = threading.Lock()
+
+    def iter_json(self, blocks: List) -> Iterator[bytes]:
+        yield f'{{"len": {len(blocks)}, "blocks": ['.encode()
+        for start in range(0, len(blocks), self.PAGE_SIZE):
+            page = ', '.join(response(block.info) for block in blocks[start:start + self.PAGE_SIZE])
+            yield (', ' + page if start else page).encode()
+        yield b']}'
+
+    def get(self, blocks: List, binary: bool, gzip: bool) -> bytes or Iterator[bytes]:
+        chunks = codec.iter_chain(blocks, self.PAGE_SIZE) if binary else self.iter_json(blocks)
+        if gzip:
+            chunks = compress(chunks)
+        if len(blocks) > self.max_blocks:
+            return chunks
+        with self.lock:
+            if self.tip != blocks[-1].hash:
+                self.tip, self.bodies = blocks[-1].hash, {}
+            if (binary, gzip) not in self.bodies:
+                self.bodies[binary, gzip] = b''.join(chunks)
+            return self.bodies[binary, gzip]
@@ -1,26 +1,59 @@
 import logging
 import os
-from typing import Literal
+import threading
+from typing import Dict, Literal, List
 
 import requests
 
+from src import codec
+from src.utils import get_env_var
 from src.wallet import Wallet
 
 
+_sessions = threading.local()
+
+
+def get_session(url: str) -> requests.Session:
+	""" Keep-alive session per node and thread (sessions aren't thread safe), shared by all clients of the node """
+	sessions: Dict[str, requests.Session] = _sessions.__dict__.setdefault('by_url', {})
+	if url not in sessions:
+		sessions[url] = requests.Session()
+	return sessions[url]
+
+
 class HttpJsonClient:
-	def __init__(self, url, address: str = None):
+	def __init__(self, url, address: str = None, binary: bool = None, timeout: float = None):
 		self.url = url
 		self.address = address
+		self.binary = bool(int(get_env_var('BINARY_TRANSPORT', 1))) if binary is None else binary
+		self.timeout = timeout if timeout else float(get_env_var('HTTP_TIMEOUT', 5))  # sec
+		self.wallets = {}
+
+	@property
+	def session(self) -> requests.Session:
+		return get_session(self.url)
 
-	def request(self, method: Literal["get", "post"], endpoint: str, json: dict = None, params: dict = None) -> dict or list:
+	def request(
+			self, method: Literal["get", "post"], endpoint: str, json: dict = None, params: dict = None,
+			data: bytes = None, headers: dict = None,
+	) -> dict or list:
 		try:
-			response = requests.request(method, f'{self.url}/{endpoint}', params=params, json=json)
+			response = self.session.request(
+				method, f'{self.url}/{endpoint}', params=params, json=json, data=data, headers=headers,
+				timeout=self.timeout,
+			)
 			if response.ok:
+				if response.headers.get('Content-Type', '').startswith(codec.CONTENT_TYPE):
+					return codec.loads(response.content)
 				return response.json()
 			else:
 				logging.error(f'Error while HTTP request (code: {response.status_code}, content: {response.content}')
 		except requests.exceptions.ConnectionError:
 			logging.error(f"Can't connect to node {self.url}")
+		except requests.exceptions.Timeout:
+			logging.error(f'Node {self.url} has not responded in {self.timeout} sec')
+		except codec.DecodeError as e:
+			logging.error(f'Invalid binary response from node {self.url}: {e}')
 
 	def get(self, endpoint: str, **kwargs):
 		return self.request('get', endpoint, **kwargs)
@@ -29,28 +62,74 @@ class HttpJsonClient:
 		return self.request('post', endpoint, **kwargs)
 
 	def get_chain(self):
-		return self.get('chain')
+		return self.get('chain', headers={'Accept': codec.CONTENT_TYPE} if self.binary else None)
+
+	def get_tip(self):
+		return self.get('tip')
+
+	def get_headers(self, start: int, end: int):
+		return self.get('headers', params={'from': start, 'to': end})
+
+	def get_blocks(self, start: int, limit: int):
+		return self.get(
+			'blocks', params={'from': start, 'limit': limit},
+			headers={'Accept': codec.CONTENT_TYPE} if self.binary else None,
+		)
+
+	def notify(self, requests_: List[dict]):
+		""" Forward users' requests to the node """
+		if self.binary:
+			try:
+				data = codec.dumps_requests(requests_)
+				return self.post('notify', data=data, headers={'Content-Type': codec.CONTENT_TYPE})
+			except codec.EncodeError as e:
+				logging.warning(f'Requests forwarded as json: {e}')
+		return self.post('notify', json=requests_)
+
+	def announce(self, announcement: dict):
+		""" Push the new block header and its transaction hashes to the node """
+		return self.post('announce', json=announcement)
+
+	def get_block_transactions(self, block_hash: str, indexes: List[int]):
+		return self.get(f'block/{block_hash}/transactions', params={'indexes': ','.join(map(str, indexes))})
+
+	def get_proof(self, tx_hash: str):
+		return self.get(f'proof/{tx_hash}')
+
+	def get_transaction(self, tx_hash: str):
+		return self.get(f'tx/{tx_hash}')
+
+	def get_history(self, address: str = None, cursor: str = None, limit: int = None):
+		params = {key: value for key, value in (('cursor', cursor), ('limit', limit)) if value is not None}
+		return self.get(f'address/{address if address else self.address}/history', params=params)
+
+	def get_wallet(self, sender: str = None, private_key: str = None, public_key: str = None) -> Wallet:
+		""" Wallets are cached to sign many transactions with the same key """
+		key = (
+			sender if sender else os.getenv('ADDRESS'),
+			private_key if private_key else os.getenv('PRIVATE_KEY'),
+			public_key if public_key else os.getenv('PUBLIC_KEY'),
+		)
+		if key not in self.wallets:
+			self.wallets[key] = Wallet(address=key[0], private_key=key[1], public_key=key[2])
+		return self.wallets[key]
 
 	def create_transaction(
 			self, amount: str, fee: str, recipient: str, lock_script: str = None,
 			sender: str = None, private_key: str = None, public_key: str = None,
 	) -> dict:
-		wallet = Wallet(
-			address=sender if sender else os.getenv('ADDRESS'),
-			private_key=private_key if private_key else os.getenv('PRIVATE_KEY'),
-			public_key=public_key if public_key else os.getenv('PUBLIC_KEY')
-		)
+		wallet = self.get_wallet(sender, private_key, public_key)
 		transaction = wallet.create_transaction(amount=amount, fee=fee, recipient=recipient, lock_script=lock_script)
-		return self.post('send', json={
-			'public_key': transaction.public_key,
-			'signature': transaction.signature,
-			'amount': transaction.raw.amount,
-			'fee': transaction.raw.fee,
-			'sender': transaction.raw.sender,
-			'recipient': transaction.raw.recipient,
-			'timestamp': transaction.raw.timestamp,
-			'lock_script': transaction.raw.lock_script,
-		})
+		return self.post('send', json=transaction.request)
+
+	def create_transactions(
+			self, transfers: List[dict],
+			sender: str = None, private_key: str = None, public_key: str = None,
+	) -> dict:
+		""" Signs transfers ({'amount': ..., 'fee': ..., 'recipient': ..., 'lock_script': ...}) and sends them at once """
+		wallet = self.get_wallet(sender, private_key, public_key)
+		transactions = [wallet.create_transaction(**transfer) for transfer in transfers]
+		return self.post('send_batch', json=[transaction.request for transaction in transactions])
 
 	def get_balance(self):
 		return self.get('balance', json={'address': self.address})
@@ -0,0 +1,108 @@
+import logging
+import queue
+import threading
+from collections import OrderedDict, deque
+from typing import List, Tuple
+
+from src import codec
+from src.chain import Transaction
+from src.http.client import HttpJsonClient
+from src.http.peers import PeerPool
+
+
+class Broadcaster:
+    """
+    Users' requests are relayed to other nodes in background, batched per node.
+    Batches failed to be delivered stay in the node's outbox until its backoff has passed,
+    a transaction is relayed by the node only once (bounded set of seen transaction hashes).
+    """
+    SEEN_SIZE = 100_000
+    OUTBOX_SIZE = 10_000
+    BATCH_SIZE = 500
+    RETRY_INTERVAL = 1  # sec
+
+    def __init__(self, peers: PeerPool):
+        self.peers = peers
+        self.seen: OrderedDict = OrderedDict()
+        self.queue = queue.Queue()
+        self.outboxes = {url: deque(maxlen=self.OUTBOX_SIZE) for url in peers.clients}
+        self.sending = set()
+        self.lock = threading.Lock()
+
+    def get_new(self, requests: List[dict]) -> List[Tuple[str, dict]]:
+        """ Requests not seen before with their transaction hashes, malformed requests are skipped """
+        new = []
+        with self.lock:
+            for request in requests:
+                try:
+                    tx_hash = Transaction.from_request(request).hash
+                except (KeyError, TypeError, AttributeError, ValueError, codec.EncodeError) as e:
+                    logging.warning(f'Malformed request is not relayed: {e}')
+                    continue
+                if tx_hash in self.seen:
+                    continue
+                self.seen[tx_hash] = True
+                if len(self.seen) > self.SEEN_SIZE:
+                    self.seen.popitem(last=False)
+                new.append((tx_hash, request))
+        return new
+
+    def broadcast(self, requests: List[dict]) -> None:
+        for request in requests:
+            self.queue.put(request)
+
+    def run(self) -> None:
+        logging.info('Start broadcasting...')
+        while True:
+            requests = []
+            try:
+                requests.append(self.queue.get(timeout=self.RETRY_INTERVAL))
+                while len(requests) < self.BATCH_SIZE:
+                    requests.append(self.queue.get_nowait())
+            except queue.Empty:
+                pass
+            with self.lock:
+                for outbox in self.outboxes.values():
+                    outbox.extend(requests)
+            self.flush()
+
+    def flush(self) -> None:
+        """ Next batch is sent to every available node which has no batch in flight """
+        for client in self.peers.get_available():
+            with self.lock:
+                outbox = self.outboxes[client.url]
+                if client.url in self.sending or not outbox:
+                    continue
+                batch = [outbox.popleft() for _ in range(min(self.BATCH_SIZE, len(outbox)))]
+                self.sending.add(client.url)
+            self.peers.executor.submit(self.send, client, batch)
+
+    def announce(self, block) -> None:
+        """
+        Header and transaction hashes of the new block are pushed to every available node at once,
+        rewards are never in mempool of other nodes, so they are sent in full (prefilled)
+        """
+        announcement = {
+            'header': block.header,
+            'transactions': [transaction.hash for transaction in block.transactions],
+            'prefilled': {
+                index: {**transaction.header, 'raw': transaction.raw.fields}
+                for index, transaction in enumerate(block.transactions) if transaction.signature == '0'
+            },
+        }
+        for client in self.peers.get_available():
+            self.peers.executor.submit(self.deliver, client, announcement)
+
+    def deliver(self, client: HttpJsonClient, announcement: dict) -> None:
+        self.peers.report(client, client.announce(announcement) is not None)
+
+    def send(self, client: HttpJsonClient, batch: List[dict]) -> None:
+        try:
+            delivered = client.notify(batch) is not None
+            self.peers.report(client, delivered)
+            if not delivered:
+                with self.lock:
+                    self.outboxes[client.url].extendleft(reversed(batch))
+        finally:
+            with self.lock:
+                self.sending.discard(client.url)
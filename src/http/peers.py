@@ -0,0 +1,97 @@
+import functools
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError, as_completed
+from typing import Callable, Dict, List, Tuple
+
+from src.http.client import HttpJsonClient
+
+
+class PeerHealth:
+    """ Failed node is not queried until its backoff (doubled on every failure in a row) has passed """
+    BASE_BACKOFF = 1  # sec
+    MAX_BACKOFF = 60  # sec
+
+    def __init__(self):
+        self.failures = 0
+        self.retry_at = 0.0
+
+    @property
+    def is_available(self) -> bool:
+        return time.monotonic() >= self.retry_at
+
+    def succeeded(self) -> None:
+        self.failures = 0
+        self.retry_at = 0.0
+
+    def failed(self) -> float:
+        self.failures += 1
+        backoff = min(self.BASE_BACKOFF * 2 ** (self.failures - 1), self.MAX_BACKOFF)
+        self.retry_at = time.monotonic() + backoff
+        return backoff
+
+
+class PeerPool:
+    """ Clients of other nodes queried in parallel, unhealthy nodes are skipped while backing off """
+    TIPS_TIMEOUT = 2  # sec, slower nodes are not waited for
+
+    def __init__(self, nodes: List[str]):
+        self.clients = {node: HttpJsonClient(url=node) for node in nodes}
+        self.health: Dict[str, PeerHealth] = {node: PeerHealth() for node in nodes}
+        # tips queries, relayed requests and block announcements to the same node may be in flight at once
+        self.executor = ThreadPoolExecutor(max(len(nodes), 1) * 4, thread_name_prefix='peer')
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.clients)
+
+    def get_available(self) -> List[HttpJsonClient]:
+        with self.lock:
+            return [client for node, client in self.clients.items() if self.health[node].is_available]
+
+    def report(self, client: HttpJsonClient, succeeded: bool) -> None:
+        with self.lock:
+            health = self.health[client.url]
+            if succeeded:
+                health.succeeded()
+            else:
+                backoff = health.failed()
+                logging.warning(f'Node {client.url} failed {health.failures} times, retry in {backoff} sec')
+
+    def get_result(self, client: HttpJsonClient, future: Future) -> object:
+        """ Result of the completed request, the node is backed off if it has failed """
+        try:
+            result = future.result()
+        except Exception as e:
+            logging.error(f'Node {client.url} request error: {e}')
+            result = None
+        self.report(client, result is not None)
+        return result
+
+    def query(
+            self, request: Callable[[HttpJsonClient], object], timeout: float = None,
+    ) -> List[Tuple[HttpJsonClient, object]]:
+        """
+        Results of the request to all available nodes in order of completion received within the timeout,
+        failed nodes are backed off, late nodes are reported once they respond
+        """
+        futures = {self.executor.submit(request, client): client for client in self.get_available()}
+        results, completed = [], set()
+        try:
+            for future in as_completed(futures, timeout=timeout):
+                completed.add(future)
+                result = self.get_result(futures[future], future)
+                if result is not None:
+                    results.append((futures[future], result))
+        except TimeoutError:
+            late = [(future, client) for future, client in futures.items() if future not in completed]
+            logging.warning(f'{", ".join(client.url for _, client in late)} have not responded in {timeout} sec')
+            for future, client in late:
+                future.add_done_callback(functools.partial(self.get_result, client))
+        return results
+
+    def get_tips(self) -> List[Tuple[HttpJsonClient, dict]]:
+        """ Tips of the nodes responded in TIPS_TIMEOUT from the one with the most work """
+        tips = self.query(HttpJsonClient.get_tip, timeout=self.TIPS_TIMEOUT)
+        return sorted(tips, key=lambda item: item[1]['work'], reverse=True)
@@ -1,40 +1,213 @@
 import json
 import os
+from typing import List, Tuple
 
-from flask import request
+from flask import request, Response
 
+from src import codec
 from src.builder import AppBuilder
-from src.http.client import HttpJsonClient
+from src.chain import Transaction
+from src.http.cache import ChainCache
 from src.utils import response
 
 NODES = json.loads(os.getenv('NODES')) if os.getenv('NODES') else []
+HISTORY_PAGE_SIZE = 50
+MAX_HEADERS = 2000
+BLOCKS_PAGE_SIZE = 100
+HISTORY_MAX_PAGE_SIZE = 500
 
 app = AppBuilder(nodes=NODES, debug=False)
+chain_cache = ChainCache()
 
 
 @app.flask.route('/chain', methods=['GET'])
 def chain():
-    """ Get full chain """
-    blocks = [block.info for block in app.miner.blockchain.blocks]
-    return response({'len': len(blocks), 'blocks': blocks})
+    """
+    Get full chain, unchanged since the last request (the same last block hash) chain is not sent again.
+    Every representation (json or binary, gzip or identity) has its own entity tag
+    """
+    blocks = app.blockchain.blocks[:]
+    binary = request.accept_mimetypes.best == codec.CONTENT_TYPE
+    gzip = request.accept_encodings['gzip'] > 0  # "gzip;q=0" refuses it
+    etag = f'{blocks[-1].hash}-{"binary" if binary else "json"}{"-gzip" if gzip else ""}'
+    if request.if_none_match.contains(etag):
+        chain_response = Response(status=304)
+    else:
+        chain_response = Response(
+            chain_cache.get(blocks, binary, gzip), mimetype=codec.CONTENT_TYPE if binary else 'application/json'
+        )
+        if gzip:
+            chain_response.headers['Content-Encoding'] = 'gzip'
+    chain_response.set_etag(etag)
+    chain_response.vary.update(('Accept', 'Accept-Encoding'))
+    return chain_response
+
+
+@app.flask.route('/tip', methods=['GET'])
+def tip():
+    """ Last block of the chain and cumulative work of the chain """
+    blockchain = app.blockchain
+    with blockchain.lock:
+        last_block = blockchain.last_block
+        return response({'index': last_block.index, 'hash': last_block.hash, 'work': blockchain.get_work()})
+
+
+def get_range_args(default_limit: int, max_limit: int) -> Tuple[int, int]:
+    """ Start index and number of blocks from "from" and "to" or "limit" query parameters """
+    start = max(int(request.args.get('from', 0)), 0)
+    if 'to' in request.args:
+        limit = int(request.args['to']) - start
+    else:
+        limit = int(request.args.get('limit', default_limit))
+    return start, min(max(limit, 0), max_limit)
+
+
+@app.flask.route('/headers', methods=['GET'])
+def headers():
+    """ Headers of blocks from "from" up to "to" (exclusive) """
+    try:
+        start, limit = get_range_args(MAX_HEADERS, MAX_HEADERS)
+    except ValueError:
+        return response({'error': '"from" and "to" must be numbers'}), 400
+    return response([block.header for block in app.blockchain.blocks[start:start + limit]])
+
+
+@app.flask.route('/blocks', methods=['GET'])
+def blocks_page():
+    """ Page of blocks from "from", the same format as /chain """
+    try:
+        start, limit = get_range_args(BLOCKS_PAGE_SIZE, BLOCKS_PAGE_SIZE)
+    except ValueError:
+        return response({'error': '"from" and "limit" must be numbers'}), 400
+    blocks = app.blockchain.blocks[start:start + limit]
+    if request.accept_mimetypes.best == codec.CONTENT_TYPE:
+        return Response(codec.dumps_chain(blocks), mimetype=codec.CONTENT_TYPE)
+    return response({'len': len(blocks), 'blocks': [block.info for block in blocks]})
 
 
 @app.flask.route('/send', methods=['POST'])
 def send():
-    """ User's request to create transaction (save to db and notify other nodes) """
+    """ User's request to create transaction (save to db, relay to other nodes in background) """
     body = request.get_json()
-    app.miner.blockchain.db.save_user_request(body)
-    for node in app.nodes:
-        HttpJsonClient(node).post('notify', json=body)
-    return response({})
+    try:
+        tx_hash = Transaction.from_request(body).hash
+    except (KeyError, TypeError, AttributeError, ValueError, codec.EncodeError) as e:
+        return response({
+            'error': f'malformed transaction: {e}'
+        }), 400
+    accept([body])
+    return response({'hash': tx_hash})
+
+
+@app.flask.route('/send_batch', methods=['POST'])
+def send_batch():
+    """
+    Users' batch of signed transactions (save to db in one transaction, relay to other nodes at once),
+    malformed and already seen transactions are skipped, the number and hashes of the accepted ones are returned
+    together with the number of received ones
+    """
+    body = request.get_json()
+    if not isinstance(body, list):
+        return response({
+            'error': 'list of transactions expected'
+        }), 400
+    new = accept(body)
+    return response({'count': len(new), 'received': len(body), 'hashes': [tx_hash for tx_hash, _ in new]})
 
 
 @app.flask.route('/notify', methods=['POST'])
 def notify():
-    app.miner.blockchain.db.save_user_request(request.get_json())
+    """
+    Requests relayed by other nodes, json object or list, or binary list (see codec.dumps_requests),
+    malformed requests are skipped
+    """
+    if request.mimetype == codec.CONTENT_TYPE:
+        try:
+            requests = codec.loads(request.get_data())
+        except codec.DecodeError as e:
+            return response({'error': str(e)}), 400
+        if not isinstance(requests, list):
+            return response({'error': 'list of requests expected'}), 400
+    else:
+        body = request.get_json()
+        requests = body if isinstance(body, list) else [body]
+    accept(requests)
     return response({})
 
 
+def accept(requests: List[dict]) -> List[Tuple[str, dict]]:
+    """ Requests seen for the first time are saved, passed to the miner and relayed to other nodes """
+    new = app.broadcaster.get_new(requests)
+    if new:
+        app.blockchain.db.save_user_requests([request for _, request in new])
+        app.notify()
+        app.broadcaster.broadcast([request for _, request in new])
+    return new
+
+
+@app.flask.route('/announce', methods=['POST'])
+def announce():
+    """ New block announced by another node: header and hashes of its transactions """
+    body = request.get_json()
+    try:
+        status = app.receive_announcement(body)
+    except (KeyError, TypeError, AttributeError, ValueError):
+        return response({'error': 'header and transactions hashes expected'}), 400
+    return response({'status': status})
+
+
+@app.flask.route('/block/<block_hash>/transactions', methods=['GET'])
+def block_transactions(block_hash: str):
+    """ Transactions of a known block by comma separated positions, to complete an announced block """
+    block = app.blockchain.tree.get(block_hash)
+    if block is None:
+        return response({
+            'error': f'block {block_hash} not found'
+        }), 404
+    try:
+        transactions = [block.transactions[int(index)] for index in request.args.get('indexes', '').split(',') if index]
+    except (ValueError, IndexError):
+        return response({
+            'error': '"indexes" must be positions of the block transactions'
+        }), 400
+    return response(transactions)
+
+
+@app.flask.route('/proof/<tx_hash>', methods=['GET'])
+def proof(tx_hash: str):
+    """ Merkle inclusion proof of the transaction """
+    transaction_proof = app.blockchain.get_proof(tx_hash)
+    if not transaction_proof:
+        return response({
+            'error': f'transaction {tx_hash} not found'
+        }), 404
+    return response(transaction_proof)
+
+
+@app.flask.route('/tx/<tx_hash>', methods=['GET'])
+def transaction(tx_hash: str):
+    """ Confirmed transaction with the index of its block """
+    transaction_info = app.blockchain.db.get_transaction(tx_hash)
+    if not transaction_info:
+        return response({
+            'error': f'transaction {tx_hash} not found'
+        }), 404
+    return response(transaction_info)
+
+
+@app.flask.route('/address/<address>/history', methods=['GET'])
+def history(address: str):
+    """ Confirmed transactions of the address from the newest, the next page is requested with the returned cursor """
+    try:
+        limit = min(max(int(request.args.get('limit', HISTORY_PAGE_SIZE)), 1), HISTORY_MAX_PAGE_SIZE)
+        transactions, cursor = app.blockchain.db.get_history(address, request.args.get('cursor'), limit)
+    except ValueError:
+        return response({
+            'error': 'invalid "cursor" or "limit"'
+        }), 400
+    return response({'transactions': transactions, 'cursor': cursor})
+
+
 @app.flask.route('/balance', methods=['GET'])
 def get_balance():
     address = request.get_json().get('address')
@@ -43,7 +216,7 @@ def get_balance():
             'error': '"address" must be provided'
         }), 400
     wallet = app.wallet(address=address)
-    balance, locked_balance, untrusted_balance, untrusted_locked_balance = wallet.get_balance(app.miner.blockchain)
+    balance, locked_balance, untrusted_balance, untrusted_locked_balance = wallet.get_balance(app.blockchain)
     return response({
         'balance': balance,
         'locked_balance': locked_balance,
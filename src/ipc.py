@@ -0,0 +1,99 @@
+import logging
+import multiprocessing
+import queue
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from src.chain import Blockchain
+from src.db.connector import DatabaseConnector
+from src.miner import Miner
+
+# commands from the API process
+REQUESTS = 'requests'  # users' requests are saved to db
+ANNOUNCEMENT = 'announcement'  # block announced by another node
+STOP = 'stop'  # abort proof of work and exit
+# events from the miner process
+TIP = 'tip'  # chain tip has changed, blocks are saved to db
+
+
+def run_miner(commands: multiprocessing.Queue, events: multiprocessing.Queue, debug: bool) -> None:
+    """ Miner process: owns the chain writes, executes commands of the API process and reports tip updates """
+    miner = Miner(Blockchain(), debug=debug)
+    miner.blockchain.listeners.append(lambda block: events.put((TIP, block.index, block.hash)))
+    events.put((TIP, miner.blockchain.last_block.index, miner.blockchain.last_block.hash))
+    threading.Thread(daemon=True, target=miner.ingest).start()
+    threading.Thread(daemon=True, target=miner.main).start()
+    announcements = ThreadPoolExecutor(1)  # in order, without blocking other commands
+    while True:
+        command, *args = commands.get()
+        if command == REQUESTS:
+            miner.notify()
+        elif command == ANNOUNCEMENT:
+            announcements.submit(receive_announcement, miner, *args)
+        elif command == STOP:
+            miner.stop()
+            break
+
+
+def receive_announcement(miner: Miner, announcement: dict) -> None:
+    try:
+        logging.info(f'Announcement: {miner.receive_announcement(announcement)}')
+    except (KeyError, TypeError, AttributeError, ValueError):
+        logging.error(f'Invalid announcement: {traceback.format_exc()}')
+
+
+class MinerProcess:
+    """
+    Miner running in its own process, so proof of work doesn't hold the GIL of the API process.
+    The miner writes blocks to the shared db, the API process keeps a read replica of the chain,
+    which is reloaded by update_local_chain on every tip update.
+    """
+    START_TIMEOUT = 120  # sec, to prepare db and load the chain
+
+    def __init__(self, debug: bool = False):
+        self.commands = multiprocessing.Queue()
+        self.events = multiprocessing.Queue()
+        self.process = multiprocessing.Process(target=run_miner, args=(self.commands, self.events, debug))
+        self.process.start()
+        self.wait_started()
+        self.blockchain = Blockchain()
+        self.blockchain.db = DatabaseConnector(debug=debug)
+        self.blockchain.update_local_chain()
+        threading.Thread(daemon=True, target=self.follow).start()
+
+    def wait_started(self) -> None:
+        """ Until db is prepared and the genesis block is saved, fails if the miner process has died """
+        deadline = time.monotonic() + self.START_TIMEOUT
+        while time.monotonic() < deadline:
+            try:
+                self.events.get(timeout=1)
+                return
+            except queue.Empty:
+                if not self.process.is_alive():
+                    raise RuntimeError(f'Miner process exited with code {self.process.exitcode}')
+        self.process.terminate()
+        raise RuntimeError(f'Miner process has not started in {self.START_TIMEOUT} sec')
+
+    def follow(self) -> None:
+        """ Chain replica is updated up to the latest tip reported by the miner process """
+        while True:
+            _, *tip = self.events.get()
+            while not self.events.empty():  # several blocks are loaded at once
+                _, *tip = self.events.get_nowait()
+            try:
+                self.blockchain.update_local_chain(tuple(tip))
+            except Exception as e:
+                logging.error(f'Chain update error: {e}, {traceback.format_exc()}')
+
+    def notify(self) -> None:
+        self.commands.put((REQUESTS,))
+
+    def receive_announcement(self, announcement: dict) -> str:
+        self.commands.put((ANNOUNCEMENT, announcement))
+        return 'queued'
+
+    def stop(self) -> None:
+        self.commands.put((STOP,))
+        self.process.join(timeout=Miner.STOP_TIMEOUT)
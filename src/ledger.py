@@ -0,0 +1,175 @@
+import threading
+from collections import OrderedDict, defaultdict
+from decimal import Decimal
+from typing import Dict, List, Tuple
+
+from src.script import engine
+
+Balance = List[Decimal]  # [balance, locked_balance]
+
+
+class BalanceLedger:
+    """
+    Balances by address, updated on every appended block instead of the full chain scan.
+    Changes of the latest `trust_confirmations` blocks are kept per block (untrusted balance),
+    older blocks are folded into trusted balances.
+    Credits with time dependent lock scripts are kept aside and checked on every request.
+    """
+
+    def __init__(self, trust_confirmations: int):
+        self.trust_confirmations = trust_confirmations
+        self.height = -1
+        self.trusted: Dict[str, Balance] = {}
+        self.recent: Dict[int, Dict[str, Balance]] = OrderedDict()
+        self.timelocks: Dict[str, List[Tuple[int, Decimal, str]]] = defaultdict(list)
+        self.lock = threading.RLock()
+
+    @property
+    def settled_height(self) -> int:
+        return self.height - self.trust_confirmations
+
+    @staticmethod
+    def get_changes(block) -> Tuple[Dict[str, Balance], List[Tuple[str, Decimal, str]]]:
+        """ Balance changes by address and time locked credits of the block (see Wallet.get_transaction_balance) """
+        changes = defaultdict(lambda: [Decimal(0), Decimal(0)])
+        timelocks = []
+        for transaction in block.transactions:
+            raw = transaction.raw
+            amount = Decimal(raw.amount)
+            if raw.lock_script and engine.uses_time(raw.lock_script):
+                timelocks.append((raw.recipient, amount, raw.lock_script))
+            elif raw.lock_script and engine.is_locked(raw.lock_script):
+                changes[raw.recipient][1] += amount
+            else:
+                changes[raw.recipient][0] += amount
+            changes[raw.sender][0] -= amount - Decimal(raw.fee)
+        return changes, timelocks
+
+    def _add_trusted(self, changes: Dict[str, Balance], sign: int = 1) -> None:
+        for address, (balance, locked_balance) in changes.items():
+            trusted = self.trusted.setdefault(address, [Decimal(0), Decimal(0)])
+            trusted[0] += sign * balance
+            trusted[1] += sign * locked_balance
+
+    def apply(self, block) -> None:
+        with self.lock:
+            changes, timelocks = self.get_changes(block)
+            self.recent[block.index] = changes
+            for address, amount, lock_script in timelocks:
+                self.timelocks[address].append((block.index, amount, lock_script))
+            self.height = block.index
+            while self.recent and next(iter(self.recent)) <= self.settled_height:
+                _, settled = self.recent.popitem(last=False)
+                self._add_trusted(settled)
+
+    def revert(self, block, chain: list) -> None:
+        """ Rolls back the last applied block, `chain` must contain blocks below it """
+        with self.lock:
+            changes = self.recent.pop(block.index, None)
+            if changes is None:
+                changes, _ = self.get_changes(block)
+                self._add_trusted(changes, sign=-1)
+            for address, timelocks in self.timelocks.items():
+                timelocks[:] = [timelock for timelock in timelocks if timelock[0] != block.index]
+            settled_height = self.settled_height
+            self.height = block.index - 1
+            if self.trust_confirmations and settled_height >= 0:
+                unsettled, _ = self.get_changes(chain[settled_height])
+                self._add_trusted(unsettled, sign=-1)
+                self.recent[settled_height] = unsettled
+                self.recent.move_to_end(settled_height, last=False)
+
+    def get_balance(self, address: str, timestamp: int = None) -> Tuple[Decimal, Decimal, Decimal, Decimal]:
+        """
+        Trusted, trusted locked, untrusted and untrusted locked balances like Wallet.get_balance,
+        time locks are checked at the timestamp, actual time by default
+        """
+        with self.lock:
+            balance, locked_balance = self.trusted.get(address, (Decimal(0), Decimal(0)))
+            untrusted_balance = untrusted_locked_balance = Decimal(0)
+            for changes in self.recent.values():
+                if address in changes:
+                    untrusted_balance += changes[address][0]
+                    untrusted_locked_balance += changes[address][1]
+            for index, amount, lock_script in self.timelocks.get(address, ()):
+                locked = engine.is_locked(lock_script, timestamp)
+                if index <= self.settled_height:
+                    if locked:
+                        locked_balance += amount
+                    else:
+                        balance += amount
+                elif locked:
+                    untrusted_locked_balance += amount
+                else:
+                    untrusted_balance += amount
+        return balance, locked_balance, untrusted_balance, untrusted_locked_balance
+
+    def dump(self) -> dict:
+        """ JSON compatible state to restore the ledger from a snapshot """
+        with self.lock:
+            return {
+                'height': self.height,
+                'trusted': {address: [str(value) for value in balance] for address, balance in self.trusted.items()},
+                'recent': [
+                    [index, {address: [str(value) for value in balance] for address, balance in changes.items()}]
+                    for index, changes in self.recent.items()
+                ],
+                'timelocks': {
+                    address: [[index, str(amount), lock_script] for index, amount, lock_script in timelocks]
+                    for address, timelocks in self.timelocks.items() if timelocks
+                },
+            }
+
+    def restore(self, state: dict) -> None:
+        with self.lock:
+            self.height = state['height']
+            self.trusted = {
+                address: [Decimal(value) for value in balance] for address, balance in state['trusted'].items()
+            }
+            self.recent = OrderedDict(
+                (index, {address: [Decimal(value) for value in balance] for address, balance in changes.items()})
+                for index, changes in state['recent']
+            )
+            self.timelocks = defaultdict(list, {
+                address: [(index, Decimal(amount), lock_script) for index, amount, lock_script in timelocks]
+                for address, timelocks in state['timelocks'].items()
+            })
+
+
+class BranchBalances:
+    """
+    Spendable (not locked) balances at the tip of another branch replayed over the ledger, which stays untouched:
+    blocks of the main chain above the fork point are rolled back and blocks of the branch are applied aside.
+    Credits with time dependent lock scripts are kept aside as in the ledger and checked at the requested timestamp
+    (e.g. of the block spending them), so every node gets the same balances
+    """
+
+    def __init__(self, ledger: BalanceLedger):
+        self.ledger = ledger
+        self.changes: Dict[str, Decimal] = defaultdict(Decimal)
+        self.timelocks: Dict[str, List[Tuple[Decimal, str]]] = defaultdict(list)
+        self.balances: Dict[Tuple[str, int], Decimal] = {}  # of the ledger by (address, timestamp)
+
+    def get(self, address: str, timestamp: int = None) -> Decimal:
+        """ Spendable balance at the timestamp (µs), actual time by default """
+        if (address, timestamp) not in self.balances:
+            balance, _, untrusted_balance, _ = self.ledger.get_balance(address, timestamp)
+            self.balances[(address, timestamp)] = balance + untrusted_balance
+        return self.balances[(address, timestamp)] + self.changes.get(address, Decimal(0)) + sum(
+            (amount for amount, lock_script in self.timelocks.get(address, ())
+             if not engine.is_locked(lock_script, timestamp)),
+            Decimal(0),
+        )
+
+    def apply(self, transaction, sign: int = 1) -> None:
+        raw = transaction.raw
+        amount = Decimal(raw.amount)
+        if raw.lock_script and engine.uses_time(raw.lock_script):
+            self.timelocks[raw.recipient].append((sign * amount, raw.lock_script))
+        elif not (raw.lock_script and engine.is_locked(raw.lock_script)):
+            self.changes[raw.recipient] += sign * amount
+        self.changes[raw.sender] -= sign * (amount - Decimal(raw.fee))
+
+    def apply_block(self, block, sign: int = 1) -> None:
+        for transaction in block.transactions:
+            self.apply(transaction, sign)
@@ -0,0 +1,105 @@
+import heapq
+import itertools
+import logging
+import threading
+from decimal import Decimal
+from typing import Dict, Iterable, List, Tuple
+
+from src import codec
+from src.utils import actual_time, get_env_var
+
+
+class Mempool:
+    """
+    Pending transactions indexed by hash and ordered by fee rate (fee per byte of the encoded transaction).
+    Transactions stay in the pool until a block containing them is added,
+    the oldest and the cheapest ones are evicted when the pool is overflowed.
+    """
+
+    def __init__(self, max_size: int = None, max_age: int = None):
+        self.max_size = max_size if max_size else int(get_env_var('MEMPOOL_MAX_SIZE', 10_000))
+        self.max_age = (max_age if max_age else int(get_env_var('MEMPOOL_MAX_AGE', 3600))) * 1_000_000  # sec -> mcs
+        self.transactions: Dict[str, object] = {}
+        self.arrivals: Dict[str, int] = {}
+        # entries of removed transactions are dropped lazily, when they are popped or the heaps are rebuilt
+        self.heap: List[Tuple[Decimal, int, str]] = []  # (-fee rate, arrival time, hash), the best first
+        self.evictions: List[Tuple[Decimal, int, str]] = []  # (fee rate, -arrival time, hash), the cheapest first
+        self.lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.transactions)
+
+    def __contains__(self, tx_hash: str):
+        return tx_hash in self.transactions
+
+    @staticmethod
+    def get_fee_rate(transaction) -> Decimal:
+        return Decimal(transaction.raw.fee) / len(codec.encode_transaction(transaction))
+
+    def _is_pending(self, tx_hash: str, arrival: int) -> bool:
+        """ Heap entry is of a transaction still in the pool (not re-added since) """
+        return self.arrivals.get(tx_hash) == arrival
+
+    def add(self, transaction) -> bool:
+        with self.lock:
+            tx_hash = transaction.hash
+            if tx_hash in self.transactions:
+                return False
+            arrival = actual_time()
+            fee_rate = self.get_fee_rate(transaction)
+            self.transactions[tx_hash] = transaction
+            self.arrivals[tx_hash] = arrival
+            heapq.heappush(self.heap, (-fee_rate, arrival, tx_hash))
+            heapq.heappush(self.evictions, (fee_rate, -arrival, tx_hash))
+            self.evict()
+            return tx_hash in self.transactions
+
+    def get(self, tx_hash: str):
+        return self.transactions.get(tx_hash)
+
+    def remove(self, transactions: Iterable) -> None:
+        with self.lock:
+            for transaction in transactions:
+                self._discard(transaction.hash)
+            self._compact()
+
+    def _discard(self, tx_hash: str) -> None:
+        self.transactions.pop(tx_hash, None)
+        self.arrivals.pop(tx_hash, None)
+
+    def _compact(self) -> None:
+        """ Heaps are rebuilt when most of their entries are of removed transactions """
+        if len(self.heap) > 2 * len(self.transactions):
+            self.heap = [entry for entry in self.heap if self._is_pending(entry[2], entry[1])]
+            heapq.heapify(self.heap)
+        if len(self.evictions) > 2 * len(self.transactions):
+            self.evictions = [entry for entry in self.evictions if self._is_pending(entry[2], -entry[1])]
+            heapq.heapify(self.evictions)
+
+    def select(self, limit: int) -> List:
+        """ Transactions with the highest fee rate for the next block, popped from the heap and pushed back """
+        with self.lock:
+            self.evict()
+            selected = []
+            while self.heap and len(selected) < limit:
+                entry = heapq.heappop(self.heap)
+                if self._is_pending(entry[2], entry[1]) and entry not in selected:
+                    selected.append(entry)
+            for entry in selected:
+                heapq.heappush(self.heap, entry)
+            return [self.transactions[tx_hash] for _, _, tx_hash in selected]
+
+    def evict(self) -> None:
+        """ Expired transactions in arrival order, then the cheapest (the newest of equal) ones above max_size """
+        with self.lock:
+            deadline = actual_time() - self.max_age
+            expired = itertools.takewhile(lambda item: item[1] < deadline, self.arrivals.items())  # arrival order
+            for tx_hash in [tx_hash for tx_hash, _ in expired]:
+                logging.info(f'Transaction {tx_hash} evicted from mempool by age')
+                self._discard(tx_hash)
+            while len(self.transactions) > self.max_size:
+                _, arrival, tx_hash = heapq.heappop(self.evictions)
+                if self._is_pending(tx_hash, -arrival):
+                    logging.info(f'Transaction {tx_hash} evicted from mempool by size')
+                    self._discard(tx_hash)
+            self._compact()
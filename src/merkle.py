@@ -0,0 +1,47 @@
+import hashlib
+from typing import List
+
+EMPTY_ROOT = '0' * 64
+
+
+def hash_pair(left: str, right: str) -> str:
+    return hashlib.sha256(bytes.fromhex(left) + bytes.fromhex(right)).hexdigest()
+
+
+def get_levels(hashes: List[str]) -> List[List[str]]:
+    """ Tree levels from leaves to root, an unpaired last node is promoted to the next level as is """
+    levels = [list(hashes)]
+    while len(levels[-1]) > 1:
+        level = levels[-1]
+        parents = [hash_pair(level[i], level[i + 1]) for i in range(0, len(level) - 1, 2)]
+        if len(level) % 2:
+            parents.append(level[-1])
+        levels.append(parents)
+    return levels
+
+
+def get_root(hashes: List[str]) -> str:
+    if not hashes:
+        return EMPTY_ROOT
+    return get_levels(hashes)[-1][0]
+
+
+def get_proof(hashes: List[str], index: int) -> List[dict]:
+    """ Sibling hashes on the path from the leaf to the root """
+    proof = []
+    for level in get_levels(hashes)[:-1]:
+        sibling = index ^ 1
+        if sibling < len(level):
+            proof.append({'hash': level[sibling], 'position': 'left' if sibling < index else 'right'})
+        index //= 2
+    return proof
+
+
+def verify_proof(leaf: str, proof: List[dict], root: str) -> bool:
+    node = leaf
+    for step in proof:
+        if step['position'] == 'left':
+            node = hash_pair(step['hash'], node)
+        else:
+            node = hash_pair(node, step['hash'])
+    return node == root
@@ -1,38 +1,39 @@
+import functools
 import json
 import logging
 import os
 import sys
-import time
+import threading
 import traceback
-from decimal import Decimal
-from typing import List, Tuple
+from decimal import Decimal, InvalidOperation
+from typing import Dict, List, Tuple
 
-import base58
-import ecdsa
-from ecdsa.keys import BadSignatureError, MalformedPointError
-
-from src.chain import Blockchain, Block, Transaction, RawTransaction
+from src import codec
+from src.chain import Blockchain, Block, Transaction
 from src.db.connector import DatabaseConnector
 from src.http.client import HttpJsonClient
-from src.utils import actual_time
+from src.http.gossip import Broadcaster
+from src.http.peers import PeerPool
+from src.ledger import BranchBalances
+from src.pow import ProofOfWork, MiningPool
+from src.script import engine
+from src.signatures import SignatureVerifier, verify as verify_signature
+from src.utils import actual_time, get_env_var
 from src.wallet import Wallet
 
 logging.basicConfig(stream=sys.stdout, level=logging.INFO, format=f"%(asctime)s - [%(levelname)s] - %(message)s")
 
 
 class Validator:
+    MAX_FUTURE_TIME = 2 * 60 * 1_000_000  # µs
+
     def __init__(self, blockchain: Blockchain):
         self.blockchain = blockchain
+        self.signatures = SignatureVerifier()
 
     @staticmethod
     def validate_signature(public_key: str, signature: str, message: str) -> bool:
-        signature = base58.b58decode(signature)
-        try:
-            verifying_key = ecdsa.VerifyingKey.from_string(bytes.fromhex(public_key), curve=ecdsa.SECP256k1)
-            return verifying_key.verify(signature, message.encode())
-        except (BadSignatureError, MalformedPointError) as e:
-            logging.error(f'Invalid operation: {e}, {traceback.format_exc()}')
-            return False
+        return verify_signature(public_key, signature, message)
 
     def validate_balance(self, transaction: Transaction) -> bool:
         required_amount = Decimal(transaction.raw.amount) + Decimal(transaction.raw.fee)
@@ -40,83 +41,298 @@ class Validator:
         if wallet.is_balance_sufficient(self.blockchain, required_amount):
             return True
 
-    def validate_node(self, blocks: List[dict]):
-        for index, block in enumerate(blocks[1:]):
-            previous_block = blocks[index]
-            if block['previous_hash'] != previous_block['hash']:
-                logging.warning(f"{block['previous_hash']} != {previous_block['hash']}")
-                return False
-            if not self.is_valid_proof(block['hash']):
-                return False
+    @staticmethod
+    def validate_amount(transaction: Transaction) -> bool:
+        """ Amount is positive, fee isn't negative and doesn't exceed the amount """
+        try:
+            amount, fee = Decimal(transaction.raw.amount), Decimal(transaction.raw.fee)
+            return amount.is_finite() and fee.is_finite() and 0 <= fee <= amount and amount > 0
+        except (InvalidOperation, TypeError):
+            return False
+
+    def validate_blocks(self, blocks: List[Block]) -> int:
+        """ Number of leading valid blocks of another branch (see check_blocks and replay_blocks) """
+        valid = self.check_blocks(blocks)
+        with self.blockchain.lock:
+            return self.replay_blocks(blocks[:valid])
+
+    def check_blocks(self, blocks: List[Block]) -> int:
+        """
+        Number of leading blocks of another branch which are valid by themselves, the first block's parent
+        must be in the block tree. Hashes, merkle roots and proofs are recomputed, signatures of all blocks
+        are verified at once by the worker processes, the chain lock is held only while headers are checked.
+        Stops at the first invalid block
+        """
+        if not blocks:
+            return 0
+        valid, pending = 0, {}
+        with self.blockchain.lock:
+            previous = self.blockchain.tree.get(blocks[0].previous_hash)
+            for block in blocks:
+                error = self.get_block_error(block, previous, pending)
+                if error:
+                    logging.warning(f'Block {block.index} {block.hash} is invalid: {error}')
+                    break
+                valid, previous, pending[block.hash] = valid + 1, block, block
+        signed = [
+            (position, transaction) for position, block in enumerate(blocks[:valid]) if block.index
+            for transaction in block.transactions[:-1]  # the last one is the reward
+        ]
+        for (position, transaction), verified in zip(
+                signed, self.signatures.verify_batch([transaction for _, transaction in signed])
+        ):
+            if not verified:
+                logging.warning(f'Block {blocks[position].index} has incorrect signature of {transaction.hash}')
+                return position
+        return valid
+
+    def replay_blocks(self, blocks: List[Block]) -> int:
+        """
+        Number of leading checked blocks (see check_blocks) whose lock scripts and balances are valid,
+        blocks are replayed from the fork point. Must be called with the chain lock held
+        """
+        if not blocks:
+            return 0
+        parent = self.blockchain.tree.get(blocks[0].previous_hash)
+        if parent is None and blocks[0].index:
+            logging.warning(f'Block {blocks[0].index} parent {blocks[0].previous_hash} is no longer in the block tree')
+            return 0
+        side = self.blockchain.tree.get_branch(parent.hash, self.blockchain.is_main) if parent else []
+        fork = side[0].index if side else blocks[0].index
+        balances = BranchBalances(self.blockchain.ledger)
+        reverted = set()
+        for block in self.blockchain.chain[fork:]:
+            balances.apply_block(block, sign=-1)
+            reverted.update(transaction.hash for transaction in block.transactions)
+        applied = set()
+        for block in side:
+            balances.apply_block(block)
+            applied.update(transaction.hash for transaction in block.transactions)
+        for position, block in enumerate(blocks):
+            for transaction in block.transactions:
+                if transaction.hash in applied or (
+                        self.blockchain.is_confirmed(transaction) and transaction.hash not in reverted
+                ):
+                    error = 'Already confirmed'
+                else:
+                    issued = not block.index or transaction is block.transactions[-1]  # genesis or reward
+                    error = self.replay(transaction, balances, block.timestamp, issued)
+                if error:
+                    logging.warning(f'Block {block.index} transaction {transaction.hash} is invalid: {error}')
+                    return position
+                applied.add(transaction.hash)
+        return len(blocks)
+
+    def get_header_error(self, block: Block, previous: Block or None, pending: Dict[str, Block]) -> str or None:
+        """ Checks of the block header, `pending` blocks below the block aren't in the block tree yet """
+        if previous is None and (block.index or block.previous_hash != '0'):
+            return 'Unknown parent'
+        if previous is not None and (block.index != previous.index + 1 or block.previous_hash != previous.hash):
+            return 'Not linked to the previous block'
+        if previous is not None and not previous.timestamp < block.timestamp <= actual_time() + self.MAX_FUTURE_TIME:
+            return 'Timestamp is out of range'  # time span of the retarget window can't be forged
+        if previous is None:
+            target = self.blockchain.initial_target
+        else:
+            target = self.blockchain.get_next_target(previous, pending)
+        if block.target != target:
+            return f'Target {block.target:064x} != {target:064x}'
+        if not isinstance(block.nonce, int) or not 0 <= block.nonce <= codec.MAX_NONCE:
+            return 'Invalid nonce'
+        if block.index and not self.is_valid_proof(block):  # genesis isn't mined
+            return 'Invalid proof'
+
+    def get_block_error(self, block: Block, previous: Block or None, pending: Dict[str, Block]) -> str or None:
+        """ Checks of the block which don't depend on balances """
+        error = self.get_header_error(block, previous, pending)
+        if error:
+            return error
+        if not block.transactions or len(block.transactions) > Block.MAX_SIZE:
+            return f'Size {len(block.transactions)} is not in 1..{Block.MAX_SIZE}'
+        try:
+            if block.merkle_root != block.get_merkle_root():
+                return 'Invalid merkle root'
+        except codec.EncodeError as e:
+            return f'Malformed transaction: {e}'
+        if len({transaction.hash for transaction in block.transactions}) != len(block.transactions):
+            return 'Duplicate transactions'
+        if not block.index and not self.is_genesis(block):
+            return 'Invalid genesis'
+        reward = block.transactions[-1]
+        if block.index and (
+                reward.raw.sender != 'root' or not self.validate_amount(reward)
+                or Decimal(reward.raw.amount) != self.blockchain.block_reward or Decimal(reward.raw.fee)
+        ):
+            return 'Invalid reward'
+
+    def is_genesis(self, block: Block) -> bool:
+        """ Genesis isn't mined and its transaction isn't signed, so it may only issue the total emission to root """
+        if len(block.transactions) != 1:
+            return False
+        transaction = block.transactions[0]
+        raw = transaction.raw
+        return (
+                transaction.signature == '0' and transaction.public_key == '0'
+                and raw.sender == '0' and raw.recipient == 'root' and raw.lock_script == 'locked = False'
+                and self.validate_amount(transaction)
+                and Decimal(raw.amount) == self.blockchain.total_emission and not Decimal(raw.fee)
+        )
+
+    def replay(
+            self, transaction: Transaction, balances: BranchBalances, timestamp: int, issued: bool = False
+    ) -> str or None:
+        """
+        Applies the transaction to the branch balances unless it's invalid, rewards are issued by root unchecked.
+        Lock scripts are run at the timestamp of the block, not at the actual time, so every node gets the same result
+        """
+        if not issued:
+            if not self.validate_amount(transaction):
+                return 'Invalid amount'
+            lock_script_validated, message = self.validate_lock_script(transaction.raw.lock_script, timestamp)
+            if not lock_script_validated:
+                return message
+            required_amount = Decimal(transaction.raw.amount) + Decimal(transaction.raw.fee)
+            if balances.get(transaction.raw.sender, timestamp) < required_amount:
+                return 'Insufficient balance'
+        balances.apply(transaction)
+
+    def validate_headers(self, headers: List[dict], previous: Block or None, pending: Dict[str, Block]) -> bool:
+        """
+        Headers are linked, their hashes match the contents, targets are retargeted as ours and proofs satisfy them.
+        Valid headers are collected to `pending` (by hash) to check the headers following them
+        """
+        with self.blockchain.lock:
+            for header in headers:
+                block = Block.from_header(header)
+                error = self.get_header_error(block, previous, pending)  # the nonce is checked before hashing
+                if error:
+                    logging.warning(f"Block {header['index']} header is invalid: {error}")
+                    return False
+                if block.hash != header['hash']:
+                    logging.warning(f"Block {header['index']} hash is invalid {header['hash']}")
+                    return False
+                pending[block.hash] = previous = block
         return True
 
-    def is_valid_proof(self, proof: str) -> bool:
-        return proof.startswith('0' * self.blockchain.difficulty)
+    @staticmethod
+    def is_valid_proof(block: Block) -> bool:
+        return int(block.hash, 16) <= block.target
 
     @staticmethod
-    def validate_lock_script(code: str):
+    def validate_lock_script(code: str, timestamp: int = None):
         if code:
-            for string in 'import', 'subprocess':
-                if string in code:
-                    return False, f'"{string}" is not allowed'
-            local = {'time': time.time}
-            exec(code, dict(), local)
-            locked = local.get('locked')
-            if locked is None or not isinstance(locked, bool):
-                logging.info(f'locked: {locked}')
-                return False, 'lock_script must have assignment "locked = ...", where locked contain "bool" value'
+            return engine.validate(code, timestamp)
         return True, 0
 
 
 class Miner(Validator):
+    INGESTION_INTERVAL = 1  # sec
+    INGESTION_BATCH_SIZE = 1000  # requests
+    STOP_TIMEOUT = 5  # sec
+    HEADERS_PAGE_SIZE = 2000
+    BLOCKS_PAGE_SIZE = 100
+
     def __init__(self, blockchain: Blockchain, debug: bool = False):
         super().__init__(blockchain)
+        self.requests_saved = threading.Event()
+        self.stopped = threading.Event()
+        workers = int(get_env_var('MINING_WORKERS', 1))
+        self.mining_pool = MiningPool(workers or os.cpu_count()) if workers != 1 else None
         self.address = os.getenv('ADDRESS') if os.getenv('ADDRESS') else Wallet().address
 
         self.blockchain = blockchain
-        self.blockchain.db = DatabaseConnector(drop_and_create=True, debug=debug)
+        persistent = bool(int(get_env_var('PERSISTENT', 0)))  # keep the chain between restarts
+        self.blockchain.db = DatabaseConnector(drop_and_create=not persistent, debug=debug)
         self.blockchain.update_local_chain()
         if not len(self.blockchain):
             self.blockchain.create_initial_block()
 
         self.nodes: List[str] = json.loads(os.getenv('NODES')) if os.getenv('NODES') else []
+        self.peers = PeerPool(self.nodes)
+        self.broadcaster = Broadcaster(self.peers)
 
     def mine(self) -> Block or None:
-        last_block = self.blockchain.last_block
-        self.blockchain.unconfirmed_transactions.append(self.blockchain.pay_fee(self.address))
+        with self.blockchain.lock:
+            last_block = self.blockchain.last_block
+            target = self.blockchain.get_next_target(last_block)
+        timestamp = max(actual_time(), last_block.timestamp + 1)
+        transactions = self.get_spendable(self.blockchain.mempool.select(Block.MAX_SIZE - 1), timestamp)
         new_block = Block(
             index=last_block.index + 1,
-            transactions=self.blockchain.unconfirmed_transactions,
-            timestamp=actual_time(),
+            transactions=[*transactions, self.blockchain.pay_fee(self.address)],
+            timestamp=timestamp,
             previous_hash=last_block.hash,
+            target=target,
         )
-        if self.proof_of_work(new_block):
-            self.add_block(new_block)
-        self.blockchain.unconfirmed_transactions = []
-        return new_block
-
-    def proof_of_work(self, block: Block) -> bool:
-        block.nonce = 0
-        while not self.is_valid_proof(block.hash):
-            if not block.nonce % 500_000:
-                if self.sync_nodes():
-                    return False
-            block.nonce += 1
-        logging.info(f'PoW completed after {block.nonce} iterations')
-        return True
+        mined_block = self.proof_of_work(new_block)
+        if mined_block:
+            with self.blockchain.lock:
+                if self.blockchain.last_block.hash != mined_block.previous_hash:
+                    logging.info(f'Mined block {mined_block.index} is outdated, the chain has been extended')
+                    return None
+                self.add_block(mined_block)
+            self.broadcaster.announce(mined_block)
+        return mined_block
+
+    def get_spendable(self, transactions: List[Transaction], timestamp: int) -> List[Transaction]:
+        """
+        Transactions valid when applied one after another (e.g. two spends of the same balance are not)
+        in a block of the timestamp, as other nodes replay them in replay_blocks, the rest are dropped from the mempool
+        """
+        spendable, dropped = [], []
+        with self.blockchain.lock:
+            balances = BranchBalances(self.blockchain.ledger)
+            for transaction in transactions:
+                (dropped if self.replay(transaction, balances, timestamp) else spendable).append(transaction)
+        if dropped:
+            logging.info(f'{len(dropped)} transactions dropped from mempool, balance is insufficient')
+            self.blockchain.mempool.remove(dropped)
+        return spendable
+
+    def is_outdated(self, block: Block) -> bool:
+        """ Mining is stopped, the chain has been extended by a received block or another node has more work """
+        if self.stopped.is_set() or self.blockchain.last_block.hash != block.previous_hash:
+            return True
+        return bool(self.sync_nodes())
+
+    def proof_of_work(self, block: Block) -> Block or None:
+        interrupt = functools.partial(self.is_outdated, block)
+        if self.mining_pool:
+            nonce, hashrate = self.mining_pool.search(
+                block.header_prefix, block.target, interrupt=interrupt
+            )
+        else:
+            engine = ProofOfWork(block.header_prefix, block.target)
+            nonce, hashrate = engine.search(interrupt=interrupt), engine.hashrate
+        if nonce is None:
+            return None
+        logging.info(f'PoW completed, nonce {nonce} ({hashrate})')
+        return block.replace(nonce=nonce)
 
     def add_block(self, block: Block) -> None:
         if self.blockchain.last_block.hash != block.previous_hash:
             logging.error(f'{self.blockchain.last_block.hash} != {block.previous_hash}')
             raise
-        if not self.is_valid_proof(block.hash):
+        if not self.is_valid_proof(block):
             logging.error(f'Proof invalid {block.hash}')
             raise
+        if block.merkle_root != block.get_merkle_root():
+            logging.error(f'Merkle root invalid {block.merkle_root}')
+            raise
+        if len(block.transactions) > Block.MAX_SIZE:
+            logging.error(f'Block size {len(block.transactions)} exceeds {Block.MAX_SIZE}')
+            raise
         self.blockchain + block
 
-    def validate(self, transaction: Transaction) -> Tuple[bool, str]:
-        if not self.validate_signature(transaction.public_key, transaction.signature, transaction.raw.hash):
+    def validate(self, transaction: Transaction, signature_verified: bool = None) -> Tuple[bool, str]:
+        if signature_verified is None:
+            signature_verified = self.signatures.verify(transaction)
+        if not signature_verified:
             return False, 'Incorrect signature'
+        if not self.validate_amount(transaction):
+            return False, 'Invalid amount'
+        if self.blockchain.is_confirmed(transaction):
+            return False, 'Already confirmed'
         if not self.validate_balance(transaction):
             return False, 'Insufficient balance'
         lock_script_validated, message = self.validate_lock_script(transaction.raw.lock_script)
@@ -124,53 +340,202 @@ class Miner(Validator):
             return False, message
         return True, 'Validated'
 
-    def add_new_transactions(self) -> None:
+    def add_new_transactions(self) -> int:
+        """
+        Next batch of unseen users' requests is validated into mempool, the number of requests is returned.
+        Requests are marked as checked even if the batch has failed, so no request can stop the ingestion
+        """
         required = ('signature', 'public_key', 'sender', 'recipient', 'amount', 'fee')
-        for data in self.blockchain.db.get_unseen_requests():
-            tx = json.loads(data.request)
+        transactions = []
+        requests = self.blockchain.db.get_unseen_requests(limit=self.INGESTION_BATCH_SIZE)
+        try:
+            for _, request in requests:
+                try:
+                    tx = json.loads(request)
+                    if not all(key in tx.keys() for key in required):
+                        raise ValueError
+                    transaction = Transaction.from_request(tx)
+                    _ = transaction.hash  # fields which can't be encoded fail here, not in the batch
+                    transactions.append(transaction)
+                except (AttributeError, ValueError, KeyError, TypeError):
+                    logging.error(traceback.format_exc())
+            self.add_to_mempool(transactions)
+        finally:
+            self.blockchain.db.mark_requests_checked([request_id for request_id, _ in requests])
+        return len(requests)
+
+    def add_to_mempool(self, transactions: List[Transaction]) -> None:
+        for transaction, signature_verified in zip(transactions, self.signatures.verify_batch(transactions)):
             try:
-                if not all(key in tx.keys() for key in required):
-                    raise ValueError
-                transaction = Transaction(
-                    signature=tx['signature'],
-                    public_key=tx['public_key'],
-                    raw=RawTransaction(
-                        amount=tx['amount'],
-                        fee=tx['fee'],
-                        sender=tx['sender'],
-                        recipient=tx['recipient'],
-                        timestamp=tx['timestamp'],
-                        lock_script=tx['lock_script'],
-                    )
-                )
-                validated, message = self.validate(transaction)
-                if validated:
-                    self.blockchain.unconfirmed_transactions.append(transaction)
-                else:
-                    logging.info(f'Your transaction incorrect, {message}')
-            except (AttributeError, ValueError):
-                logging.error(traceback.format_exc())
-            finally:
-                self.blockchain.db.mark_requests_as_viewed(data)
+                validated, message = self.validate(transaction, signature_verified)
+            except (ArithmeticError, TypeError, ValueError) as e:
+                validated, message = False, f'Malformed transaction: {e}'
+            if validated:
+                self.blockchain.mempool.add(transaction)
+            else:
+                logging.info(f'Your transaction incorrect, {message}')
 
     def sync_nodes(self):
+        """ Tips of all nodes are queried in parallel, chains with more work are synchronized from the best one """
         logging.info('Nodes synchronization...')
-        for node in self.nodes:
-            chain = HttpJsonClient(url=node).get_chain()
-            if chain:
-                logging.info(f'{node} chain: {chain["len"]} blocks (our chain: {len(self.blockchain)})')
-                if chain['len'] > len(self.blockchain) and self.validate_node(chain['blocks']):
-                    self.blockchain.db.replace_chain(chain)
-                    self.blockchain.update_local_chain()
-                    logging.info('Chain replaced by another longer and valid chain')
-                    return True
+        for client, tip in self.peers.get_tips():
+            if tip['work'] <= self.blockchain.get_work():
+                break
+            if tip['hash'] not in self.blockchain.tree and self.sync_node(client, tip):
+                return True
+
+    def sync_node(self, client: HttpJsonClient, tip: dict) -> bool:
+        """
+        Headers-first synchronization: headers above the last common block are validated,
+        then blocks are pulled in pages, every page is fully validated (see validate_blocks) while the next one is pulled.
+        Valid blocks are added to the block tree, the chain is switched once the branch has more work,
+        synchronization stops at the first invalid block
+        """
+        logging.info(f'{client.url} tip: block {tip["index"]} (our chain: {len(self.blockchain)})')
+        common = self.find_common_height(client, tip['index'])
+        if common is None:
+            return False
+        headers, pending = [], {}
+        previous = self.blockchain.blocks[common] if common >= 0 else None
+        for start in range(common + 1, tip['index'] + 1, self.HEADERS_PAGE_SIZE):
+            page = client.get_headers(start, min(start + self.HEADERS_PAGE_SIZE, tip['index'] + 1))
+            if page is None:
+                self.peers.report(client, succeeded=False)
+            if not page or not self.validate_headers(page, previous, pending):
+                return False
+            headers += page
+            previous = pending[page[-1]['hash']]
+        switched = False
+        pages = [headers[start:start + self.BLOCKS_PAGE_SIZE] for start in range(0, len(headers), self.BLOCKS_PAGE_SIZE)]
+        fetching = self.peers.executor.submit(client.get_blocks, pages[0][0]['index'], len(pages[0])) if pages else None
+        for number, expected in enumerate(pages):
+            page = fetching.result()
+            if number + 1 < len(pages):  # the next page is downloaded while this one is validated
+                following = pages[number + 1]
+                fetching = self.peers.executor.submit(client.get_blocks, following[0]['index'], len(following))
+            if page is None:
+                self.peers.report(client, succeeded=False)
+            blocks = [Block.from_info(block) for block in page['blocks']] if page else []
+            if [block.hash for block in blocks] != [header['hash'] for header in expected]:
+                logging.warning(f'{client.url} blocks from {expected[0]["index"]} differ from their headers')
+                break
+            checked = self.check_blocks(blocks)  # signatures are verified without holding the chain lock
+            with self.blockchain.lock:
+                valid = self.replay_blocks(blocks[:checked])
+                reverted = self.blockchain.reorganize(blocks[:valid])
+            if reverted is not None:
+                switched = True
+                self.add_to_mempool(reverted)
+            if valid < len(blocks):
+                logging.warning(f'{client.url} chain is invalid from block {blocks[valid].index}')
+                self.peers.report(client, succeeded=False)
+                break
+        if switched:
+            logging.info(f'Switched to {client.url} chain with more work')
+        return switched
+
+    def find_common_height(self, client: HttpJsonClient, tip_index: int) -> int or None:
+        """ Index of a block shared with the node looked up from our tip with growing steps, -1 if there is none """
+        height = min(len(self.blockchain), tip_index + 1) - 1
+        step = 1
+        while height >= 0:
+            headers = client.get_headers(height, height + 1)
+            if headers is None:
+                self.peers.report(client, succeeded=False)
+            if not headers:
+                return None
+            if self.blockchain.blocks[height].hash == headers[0]['hash']:
+                return height
+            height -= step
+            step *= 2
+        return -1
+
+    def receive_announcement(self, announcement: dict) -> str:
+        """
+        Block announced by another node (header and transaction hashes) is rebuilt from the mempool,
+        only missing transactions are fetched. The block is announced further once it's accepted to the chain,
+        a valid block of a branch with less work is only stored in the block tree
+        """
+        header = announcement['header']
+        if header['hash'] in self.blockchain.tree:
+            return 'known'
+        parent = self.blockchain.tree.get(header['previous_hash'])
+        if parent is None:
+            return 'unknown parent'  # caught up by the next synchronization
+        if not self.validate_headers([header], parent, {}):
+            return 'invalid'
+        tx_hashes = announcement['transactions']
+        if len(tx_hashes) > Block.MAX_SIZE:
+            return 'invalid'
+        transactions = [self.blockchain.mempool.get(tx_hash) for tx_hash in tx_hashes]
+        for index, info in announcement.get('prefilled', {}).items():
+            if not 0 <= int(index) < len(transactions):
+                return 'invalid'
+            transactions[int(index)] = Transaction.from_info(info)
+        missing = [index for index, transaction in enumerate(transactions) if transaction is None]
+        if missing:
+            fetched = self.fetch_transactions(header['hash'], missing, [tx_hashes[index] for index in missing])
+            if fetched is None:
+                return 'incomplete'
+            for index, transaction in zip(missing, fetched):
+                transactions[index] = transaction
+        block = Block(
+            index=header['index'],
+            transactions=transactions,
+            timestamp=header['timestamp'],
+            previous_hash=header['previous_hash'],
+            nonce=header['nonce'],
+            merkle_root=header['merkle_root'],
+            target=header['target'],
+        )
+        if not self.check_blocks([block]):
+            return 'invalid'
+        with self.blockchain.lock:
+            if not self.replay_blocks([block]):
+                return 'invalid'
+            reverted = self.blockchain.reorganize([block])
+        if reverted is None:
+            logging.info(f'Announced block {block.index} stored, its branch has less work')
+            return 'stored'
+        self.add_to_mempool(reverted)
+        self.broadcaster.announce(block)
+        logging.info(f'Announced block {block.index} accepted, {len(missing)} transactions fetched')
+        return 'accepted'
+
+    def fetch_transactions(self, block_hash: str, indexes: List[int], tx_hashes: List[str]) -> List[Transaction] or None:
+        """ Transactions of the block by their positions from the first node which has the block """
+        for client in self.peers.get_available():
+            infos = client.get_block_transactions(block_hash, indexes)
+            if not infos or len(infos) != len(indexes):
+                continue
+            transactions = [Transaction.from_info(info) for info in infos]
+            if [transaction.hash for transaction in transactions] == tx_hashes:
+                return transactions
 
+    def notify(self) -> None:
+        """ New users' requests are saved, wakes up the ingestion """
+        self.requests_saved.set()
+
+    def ingest(self) -> None:
+        """ Validates users' requests into mempool as soon as they are saved, polls db if not notified """
+        logging.info('Start requests ingestion...')
+        while True:
+            self.requests_saved.wait(timeout=self.INGESTION_INTERVAL)
+            self.requests_saved.clear()
+            try:
+                if self.add_new_transactions() == self.INGESTION_BATCH_SIZE:
+                    self.requests_saved.set()  # the next batch is waiting
+            except BaseException as e:
+                logging.error(f'Ingestion error: {e}, {traceback.format_exc()}')
+
+    def stop(self) -> None:
+        """ Aborts proof of work and the mining loop """
+        self.stopped.set()
 
     def main(self):
         logging.info('Start mining...')
-        while True:
+        while not self.stopped.is_set():
             try:
-                self.add_new_transactions()
                 self.mine()
                 self.sync_nodes()
             except BaseException as e:
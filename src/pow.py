@@ -0,0 +1,157 @@
+import hashlib
+import multiprocessing
+import queue
+import time
+from typing import Callable, Optional, Tuple
+
+from src.codec import NONCE_SIZE
+
+MAX_TARGET = 2 ** 256 - 1  # any hash is valid
+
+
+class Hashrate:
+    """ Counts calculated hashes to report hashrate of the nonce search """
+
+    def __init__(self):
+        self.hashes = 0
+        self.started = time.perf_counter()
+
+    def update(self, hashes: int) -> None:
+        self.hashes += hashes
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    @property
+    def value(self) -> float:
+        elapsed = self.elapsed
+        return self.hashes / elapsed if elapsed else 0.0
+
+    def __str__(self):
+        return f'{self.hashes} hashes, {self.value / 1000:.1f} kH/s'
+
+
+class ProofOfWork:
+    """
+    Nonce search over a fixed block header prefix.
+    Prefix is hashed once, every nonce only copies the sha256 midstate and appends the nonce bytes.
+    """
+    INTERRUPT_INTERVAL = 500_000
+
+    def __init__(self, prefix: bytes, target: int):
+        self.midstate = hashlib.sha256(prefix)
+        self.bound = self.get_bound(target)
+        self.hashrate = Hashrate()
+
+    @staticmethod
+    def get_bound(target: int) -> Optional[bytes]:
+        """ Hash is valid if it doesn't exceed the target <=> digest is less than target + 1 """
+        if target >= MAX_TARGET:
+            return None
+        return (target + 1).to_bytes(32, 'big')
+
+    def search(
+            self, start: int = 0, step: int = 1,
+            interrupt: Callable[[], bool] = None,
+            interval: int = INTERRUPT_INTERVAL,
+    ) -> Optional[int]:
+        """ Returns the first valid nonce of start, start + step, ... or None if interrupted """
+        midstate, bound = self.midstate, self.bound
+        if bound is None:
+            return start
+        nonce = start
+        while True:
+            stop = nonce + interval * step
+            for candidate in range(nonce, stop, step):
+                digest = midstate.copy()
+                digest.update(candidate.to_bytes(NONCE_SIZE, 'big'))
+                if digest.digest() < bound:
+                    self.hashrate.update((candidate - nonce) // step + 1)
+                    return candidate
+            self.hashrate.update(interval)
+            nonce = stop
+            if interrupt and interrupt():
+                return None
+
+
+_stop: multiprocessing.Event = None
+
+
+def _init_worker(stop: multiprocessing.Event) -> None:
+    global _stop
+    _stop = stop
+
+
+def _search(prefix: bytes, target: int, start: int, step: int, interval: int) -> Tuple[Optional[int], int]:
+    engine = ProofOfWork(prefix, target)
+    nonce = engine.search(start, step, interrupt=_stop.is_set, interval=interval)
+    return nonce, engine.hashrate.hashes
+
+
+class MiningPool:
+    """
+    Process pool splitting the nonce space between workers: worker i checks nonces i, i + N, i + 2N, ...
+    The first found nonce or an interruption sets the shared stop event, which cancels the other workers.
+    """
+    WORKER_INTERVAL = 10_000
+    INTERRUPT_TIMEOUT = 1  # sec
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self.stop = multiprocessing.Event()
+        self.pool = multiprocessing.Pool(workers, initializer=_init_worker, initargs=(self.stop,))
+
+    def search(
+            self, prefix: bytes, target: int, interrupt: Callable[[], bool] = None,
+    ) -> Tuple[Optional[int], Hashrate]:
+        """ Returns the first valid nonce found by any worker or None if interrupted """
+        hashrate = Hashrate()
+        found = queue.Queue()
+        self.stop.clear()
+        results = [
+            self.pool.apply_async(
+                _search, (prefix, target, worker, self.workers, self.WORKER_INTERVAL),
+                callback=found.put, error_callback=found.put,
+            ) for worker in range(self.workers)
+        ]
+        try:
+            for _ in results:
+                while True:
+                    try:
+                        result = found.get(timeout=self.INTERRUPT_TIMEOUT)
+                        break
+                    except queue.Empty:
+                        if interrupt and interrupt():
+                            return None, hashrate
+                if isinstance(result, BaseException):
+                    raise result
+                nonce, hashes = result
+                hashrate.update(hashes)
+                if nonce is not None:
+                    return nonce, hashrate
+            return None, hashrate
+        finally:
+            self.stop.set()
+            for result in results:
+                result.wait()
+            while not found.empty():
+                result = found.get()
+                if not isinstance(result, BaseException):
+                    hashrate.update(result[1])
+
+    def close(self) -> None:
+        self.stop.set()
+        self.pool.terminate()
+
+
+def benchmark(block, hashes: int = 100_000) -> dict:
+    """ Compares hashrate of the Block.hash property against the midstate search """
+    block_hash = Hashrate()
+    for nonce in range(hashes):
+        _ = block.replace(nonce=nonce).hash
+    block_hash.update(hashes)
+
+    engine = ProofOfWork(block.header_prefix, target=0)
+    engine.search(interval=hashes, interrupt=lambda: True)
+    return {'block_hash': block_hash.value, 'midstate': engine.hashrate.value}
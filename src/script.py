@@ -0,0 +1,211 @@
+import ast
+import hashlib
+import logging
+import operator
+import threading
+import time
+from collections import OrderedDict
+from typing import Tuple
+
+
+class ScriptError(ValueError):
+    pass
+
+
+ALLOWED_NODES = (
+    ast.Module, ast.Assign, ast.Expr, ast.If, ast.IfExp, ast.Pass,
+    ast.Name, ast.Load, ast.Store, ast.Constant, ast.Call,
+    ast.BoolOp, ast.And, ast.Or,
+    ast.UnaryOp, ast.Not, ast.USub, ast.UAdd,
+    ast.BinOp, ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod,
+    ast.Compare, ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE,
+)
+ALLOWED_CALLS = ('time',)
+
+BINARY_OPERATORS = {
+    ast.Add: operator.add, ast.Sub: operator.sub, ast.Mult: operator.mul,
+    ast.Div: operator.truediv, ast.FloorDiv: operator.floordiv, ast.Mod: operator.mod,
+}
+UNARY_OPERATORS = {ast.Not: operator.not_, ast.USub: operator.neg, ast.UAdd: operator.pos}
+COMPARE_OPERATORS = {
+    ast.Eq: operator.eq, ast.NotEq: operator.ne, ast.Lt: operator.lt,
+    ast.LtE: operator.le, ast.Gt: operator.gt, ast.GtE: operator.ge,
+}
+
+
+class CompiledScript:
+    """
+    Lock script checked by the AST whitelist and interpreted in-process.
+    There are no loops and every value is bounded (MAX_INT, MAX_LENGTH), so the cost of a script is bounded
+    by its size (MAX_NODES) and the result doesn't depend on the load of the node
+    """
+    MAX_NODES = 256  # consensus limits, the same on every node
+    MAX_INT = 2 ** 256
+    MAX_LENGTH = 1024  # of str and bytes values
+
+    def __init__(self, source: str):
+        self.hash = hashlib.sha256(source.encode()).hexdigest()
+        self.source = source
+        self.tree = self.parse(source)
+        self.uses_time = any(isinstance(node, ast.Name) and node.id == 'time' for node in ast.walk(self.tree))
+
+    @classmethod
+    def parse(cls, source: str) -> ast.Module:
+        try:
+            tree = ast.parse(source, mode='exec')
+        except (SyntaxError, ValueError, RecursionError, MemoryError) as e:
+            raise ScriptError(f'lock_script syntax error: {e}')
+        nodes = 0
+        for node in ast.walk(tree):
+            nodes += 1
+            if nodes > cls.MAX_NODES:
+                raise ScriptError(f'lock_script exceeds {cls.MAX_NODES} nodes')
+            if not isinstance(node, ALLOWED_NODES):
+                raise ScriptError(f'"{type(node).__name__}" is not allowed in lock_script')
+            if isinstance(node, ast.Call):
+                if not isinstance(node.func, ast.Name) or node.func.id not in ALLOWED_CALLS or node.args or node.keywords:
+                    raise ScriptError(f'only {", ".join(f"{name}()" for name in ALLOWED_CALLS)} calls are allowed')
+            if isinstance(node, ast.Assign) and not all(isinstance(target, ast.Name) for target in node.targets):
+                raise ScriptError('only names can be assigned in lock_script')
+            if isinstance(node, ast.Constant):
+                cls.check(node.value)
+        return tree
+
+    @classmethod
+    def check(cls, value):
+        """ Value within the bounds, otherwise the script fails """
+        if isinstance(value, int) and not -cls.MAX_INT < value < cls.MAX_INT:
+            raise ScriptError(f'lock_script integer exceeds {cls.MAX_INT.bit_length() - 1} bits')
+        if isinstance(value, (str, bytes)) and len(value) > cls.MAX_LENGTH:
+            raise ScriptError(f'lock_script value exceeds {cls.MAX_LENGTH} characters')
+        return value
+
+    def run(self, timestamp: int = None):
+        """ Value of `locked` variable after the script execution, time() returns the timestamp (µs) in seconds """
+        variables = {}
+        now = time.time() if timestamp is None else timestamp / 1_000_000
+        self.execute(self.tree.body, variables, now)
+        return variables.get('locked')
+
+    def execute(self, statements: list, variables: dict, now: float) -> None:
+        for statement in statements:
+            if isinstance(statement, ast.Assign):
+                value = self.evaluate(statement.value, variables, now)
+                for target in statement.targets:
+                    variables[target.id] = value
+            elif isinstance(statement, ast.Expr):
+                self.evaluate(statement.value, variables, now)
+            elif isinstance(statement, ast.If):
+                branch = statement.body if self.evaluate(statement.test, variables, now) else statement.orelse
+                self.execute(branch, variables, now)
+
+    def evaluate(self, node: ast.expr, variables: dict, now: float):
+        try:
+            if isinstance(node, ast.Constant):
+                return node.value
+            if isinstance(node, ast.Name):
+                if node.id not in variables:
+                    raise ScriptError(f'name "{node.id}" is not defined')
+                return variables[node.id]
+            if isinstance(node, ast.Call):
+                return now
+            if isinstance(node, ast.IfExp):
+                branch = node.body if self.evaluate(node.test, variables, now) else node.orelse
+                return self.evaluate(branch, variables, now)
+            if isinstance(node, ast.BoolOp):
+                value = None
+                for operand in node.values:
+                    value = self.evaluate(operand, variables, now)
+                    if bool(value) == isinstance(node.op, ast.Or):
+                        break
+                return value
+            if isinstance(node, ast.UnaryOp):
+                return self.check(UNARY_OPERATORS[type(node.op)](self.evaluate(node.operand, variables, now)))
+            if isinstance(node, ast.BinOp):
+                left, right = self.evaluate(node.left, variables, now), self.evaluate(node.right, variables, now)
+                if isinstance(node.op, ast.Mod) and isinstance(left, (str, bytes)):
+                    raise ScriptError('string formatting is not allowed in lock_script')  # the result is unbounded
+                if isinstance(node.op, ast.Mult):  # repeated sequence is checked before it's created
+                    for sequence, times in ((left, right), (right, left)):
+                        if isinstance(sequence, (str, bytes)) and isinstance(times, int) \
+                                and len(sequence) * times > self.MAX_LENGTH:
+                            raise ScriptError(f'lock_script value exceeds {self.MAX_LENGTH} characters')
+                return self.check(BINARY_OPERATORS[type(node.op)](left, right))
+            if isinstance(node, ast.Compare):
+                left = self.evaluate(node.left, variables, now)
+                for op, comparator in zip(node.ops, node.comparators):
+                    right = self.evaluate(comparator, variables, now)
+                    if not COMPARE_OPERATORS[type(op)](left, right):
+                        return False
+                    left = right
+                return True
+        except (TypeError, ArithmeticError) as e:
+            raise ScriptError(f'lock_script execution error: {e}')
+        raise ScriptError(f'"{type(node).__name__}" is not allowed in lock_script')
+
+
+class ScriptEngine:
+    """
+    Lock scripts are parsed and checked by the AST whitelist once and cached by the script hash.
+    Scripts are interpreted in the calling thread with deterministic limits (see CompiledScript),
+    so every node gets the same result, results of scripts which don't use time() are memoized.
+    """
+    CACHE_SIZE = 4096
+
+    def __init__(self):
+        self.scripts: OrderedDict = OrderedDict()
+        self.results: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _remember(self, cache: OrderedDict, key: str, value) -> None:
+        with self._lock:
+            cache[key] = value
+            if len(cache) > self.CACHE_SIZE:
+                cache.popitem(last=False)
+
+    def compile(self, source: str) -> CompiledScript:
+        if not isinstance(source, str):
+            raise ScriptError(f'lock_script must be a string, not {type(source).__name__}')
+        script_hash = hashlib.sha256(source.encode()).hexdigest()
+        script = self.scripts.get(script_hash)
+        if script is None:
+            script = CompiledScript(source)
+            self._remember(self.scripts, script_hash, script)
+        return script
+
+    def run(self, source: str, timestamp: int = None):
+        """ Value of `locked` variable after the script execution at the timestamp (µs), actual time by default """
+        script = self.compile(source)
+        if script.hash in self.results:
+            return self.results[script.hash]
+        locked = script.run(timestamp)
+        if not script.uses_time:
+            self._remember(self.results, script.hash, locked)
+        return locked
+
+    def is_locked(self, source: str, timestamp: int = None) -> bool:
+        """ Failed scripts lock the amount """
+        try:
+            return bool(self.run(source, timestamp))
+        except ScriptError as e:
+            logging.warning(f'lock_script failed, amount is locked ({source}): {e}')
+            return True
+
+    def uses_time(self, source: str) -> bool:
+        try:
+            return self.compile(source).uses_time
+        except ScriptError:
+            return False
+
+    def validate(self, source: str, timestamp: int = None) -> Tuple[bool, str or int]:
+        try:
+            locked = self.run(source, timestamp)
+        except ScriptError as e:
+            return False, str(e)
+        if not isinstance(locked, bool):
+            logging.info(f'locked: {locked}')
+            return False, 'lock_script must have assignment "locked = ...", where locked contain "bool" value'
+        return True, 0
+
+
+engine = ScriptEngine()
@@ -0,0 +1,95 @@
+import functools
+import logging
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Tuple
+
+import base58
+import ecdsa
+from ecdsa.keys import BadSignatureError, MalformedPointError
+
+from src.utils import get_env_var
+
+KEYS_CACHE_SIZE = 1024
+
+
+@functools.lru_cache(maxsize=KEYS_CACHE_SIZE)
+def get_verifying_key(public_key: str) -> ecdsa.VerifyingKey:
+    return ecdsa.VerifyingKey.from_string(bytes.fromhex(public_key), curve=ecdsa.SECP256k1)
+
+
+def verify(public_key: str, signature: str, message: str) -> bool:
+    """ Malformed keys and signatures (e.g. null or not hex) are invalid, they never raise """
+    try:
+        return get_verifying_key(public_key).verify(base58.b58decode(signature), message.encode())
+    except (BadSignatureError, MalformedPointError, ValueError, TypeError, AttributeError) as e:
+        logging.error(f'Invalid signature: {e}')
+        return False
+
+
+def _verify_chunk(items: List[Tuple[str, str, str]]) -> List[bool]:
+    return [verify(*item) for item in items]
+
+
+class SignatureVerifier:
+    """
+    Batch signature verification spread across a process pool.
+    Verified (transaction hash, signature) pairs are remembered,
+    so the same transaction seen again via gossip or in a block is not verified twice.
+    """
+    CACHE_SIZE = 100_000
+    BATCH_THRESHOLD = 16  # smaller batches are verified in the calling thread
+
+    def __init__(self, workers: int = None):
+        self.workers = workers if workers else int(get_env_var('SIGNATURE_WORKERS', os.cpu_count()))
+        self.verified: OrderedDict = OrderedDict()
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(self.workers)
+            return self._executor
+
+    def _remember(self, key: Tuple[str, str]) -> None:
+        with self._lock:
+            self.verified[key] = True
+            if len(self.verified) > self.CACHE_SIZE:
+                self.verified.popitem(last=False)
+
+    def _is_verified(self, key: Tuple[str, str]) -> bool:
+        with self._lock:
+            if key in self.verified:
+                self.verified.move_to_end(key)
+                return True
+            return False
+
+    def verify(self, transaction) -> bool:
+        return self.verify_batch([transaction])[0]
+
+    def verify_batch(self, transactions: list) -> List[bool]:
+        results = [True] * len(transactions)
+        pending = [
+            index for index, transaction in enumerate(transactions)
+            if not self._is_verified((transaction.hash, transaction.signature))
+        ]
+        items = [
+            (transactions[index].public_key, transactions[index].signature, transactions[index].raw.hash)
+            for index in pending
+        ]
+        if len(items) < self.BATCH_THRESHOLD or self.workers <= 1:
+            verified = _verify_chunk(items)
+        else:
+            size = -(-len(items) // self.workers)
+            chunks = [items[start:start + size] for start in range(0, len(items), size)]
+            verified = [result for chunk in self.executor.map(_verify_chunk, chunks) for result in chunk]
+        for index, is_valid in zip(pending, verified):
+            results[index] = is_valid
+            if is_valid:
+                transaction = transactions[index]
+                self._remember((transaction.hash, transaction.signature))
+        return results
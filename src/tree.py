@@ -0,0 +1,78 @@
+from collections import defaultdict
+from typing import Callable, Dict, List, Set
+
+
+class BlockTree:
+    """
+    Known blocks of all branches by hash with cumulative work from the genesis block.
+    Side branches are kept to switch to them cheaply (see Blockchain.reorganize) and pruned when deep enough.
+    """
+    KEEP_DEPTH = 100
+
+    def __init__(self, get_work: Callable):
+        self.get_block_work = get_work
+        self.blocks: Dict[str, object] = {}
+        self.work: Dict[str, int] = {}
+        self.children: Dict[str, Set[str]] = defaultdict(set)
+        self.heights: Dict[int, Set[str]] = defaultdict(set)
+        self.pruned_height = 0  # blocks below it are on the main chain only
+
+    def __contains__(self, block_hash: str):
+        return block_hash in self.blocks
+
+    def get(self, block_hash: str):
+        return self.blocks.get(block_hash)
+
+    def add(self, block) -> bool:
+        """ Block is added if its parent is known or it is a genesis block """
+        if block.hash in self.blocks:
+            return True
+        if block.index and block.previous_hash not in self.blocks:
+            return False
+        self.blocks[block.hash] = block
+        self.work[block.hash] = self.work.get(block.previous_hash, 0) + self.get_block_work(block)
+        self.children[block.previous_hash].add(block.hash)
+        self.heights[block.index].add(block.hash)
+        self.pruned_height = min(self.pruned_height, block.index)
+        return True
+
+    def get_work(self, block_hash: str) -> int:
+        return self.work.get(block_hash, 0)
+
+    def get_branch(self, tip_hash: str, is_main: Callable) -> List:
+        """ Blocks from the common ancestor with the main chain (exclusive) to the tip """
+        branch = []
+        block = self.blocks.get(tip_hash)
+        while block is not None and not is_main(block):
+            branch.append(block)
+            block = self.blocks.get(block.previous_hash) if block.index else None
+        return branch[::-1]
+
+    def remove(self, block_hash: str) -> None:
+        """ Removes the block with all its descendants """
+        stack = [block_hash]
+        while stack:
+            block = self.blocks.pop(stack.pop(), None)
+            if block is None:
+                continue
+            self.work.pop(block.hash, None)
+            self._discard(self.children, block.previous_hash, block.hash)
+            self._discard(self.heights, block.index, block.hash)
+            stack.extend(self.children.pop(block.hash, ()))
+
+    @staticmethod
+    def _discard(index: Dict, key, block_hash: str) -> None:
+        hashes = index.get(key)
+        if hashes is not None:
+            hashes.discard(block_hash)
+            if not hashes:
+                del index[key]
+
+    def prune(self, height: int, is_main: Callable) -> None:
+        """ Removes side branches forked below the height, only heights above the previous pruning are checked """
+        for index in range(self.pruned_height, height):
+            for block_hash in list(self.heights.get(index, ())):
+                block = self.blocks.get(block_hash)
+                if block is not None and not is_main(block):
+                    self.remove(block_hash)
+        self.pruned_height = max(self.pruned_height, height)
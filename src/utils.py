@@ -17,6 +17,8 @@ def serialize(obj: Any):
         return str(obj)
     elif isinstance(obj, bytes):
         return obj.decode()
+    elif hasattr(obj, 'fields'):
+        return obj.fields
     else:
         try:
             return obj.__dict__
@@ -3,11 +3,12 @@ import hashlib
 import logging
 from copy import copy
 from decimal import Decimal
-import time
+
 import base58
 import ecdsa
 
 from src.chain import Blockchain, RawTransaction, Transaction
+from src.script import engine
 
 
 class Crypto:
@@ -33,7 +34,7 @@ class Crypto:
 
 
 class Wallet:
-    trust_confirmations = 3
+    trust_confirmations = Blockchain.trust_confirmations
 
     def __init__(
             self,
@@ -47,6 +48,7 @@ class Wallet:
             self.address = address
             self.private_key = private_key
             self.public_key = public_key
+        self._signing_key = None
         self.log()
 
     def log(self):
@@ -71,10 +73,7 @@ class Wallet:
         if transaction.raw.recipient == self.address:
             balance += Decimal(transaction.raw.amount)
             if transaction.raw.lock_script:
-                local = {'time': time.time}
-                exec(transaction.raw.lock_script, dict(), local)
-                locked = local.get('locked')
-                if locked:
+                if engine.is_locked(transaction.raw.lock_script):
                     logging.info(f'script locked amount {transaction.raw.amount} ({transaction.raw.lock_script})')
                     locked_balance += Decimal(transaction.raw.amount)
                     balance -= Decimal(transaction.raw.amount)
@@ -83,6 +82,10 @@ class Wallet:
         return balance, locked_balance
 
     def get_balance(self, blockchain: Blockchain):
+        return blockchain.ledger.get_balance(self.address)
+
+    def scan_balance(self, blockchain: Blockchain):
+        """ Balance calculated by the full chain scan, see BalanceLedger for the indexed one """
         balance = locked_balance = untrusted_balance = untrusted_locked_balance = Decimal(0)
         for index, block in enumerate(reversed(blockchain.chain)):
             for transaction in block.transactions:
@@ -94,12 +97,17 @@ class Wallet:
                     )
         return balance, locked_balance, untrusted_balance, untrusted_locked_balance
 
+    @property
+    def signing_key(self) -> ecdsa.SigningKey:
+        if self._signing_key is None:
+            self._signing_key = ecdsa.SigningKey.from_string(bytes.fromhex(self.private_key), curve=ecdsa.SECP256k1)
+        return self._signing_key
+
     def sign_transaction(self, message: str):
         bytes_message = message.encode()
-        signing_key = ecdsa.SigningKey.from_string(bytes.fromhex(self.private_key), curve=ecdsa.SECP256k1)
-        return base58.b58encode(signing_key.sign(bytes_message)).decode()
+        return base58.b58encode(self.signing_key.sign(bytes_message)).decode()
 
-    def create_transaction(self, amount: str, fee: str, recipient: str, lock_script: str):
+    def create_transaction(self, amount: str, fee: str, recipient: str, lock_script: str = None):
         raw_transaction = RawTransaction(
             amount=amount,
             fee=fee,
@@ -0,0 +1,50 @@
+from pytest import mark, raises
+
+from src import codec
+from src.chain import Block, Blockchain, RawTransaction, Transaction
+
+
+def create_transaction(**fields) -> Transaction:
+    return Transaction('0', '0', RawTransaction(**{
+        'amount': '1', 'fee': '0', 'sender': 'a', 'recipient': 'b', 'timestamp': 1, **fields,
+    }))
+
+
+@mark.positive
+def test_block_round_trip():
+    blockchain = Blockchain()
+    genesis = blockchain.create_initial_block()
+    block = Block(1, [create_transaction()], 2, genesis.hash, nonce=codec.MAX_NONCE)
+    info = codec.loads(codec.dumps_block(block))
+    assert Block.from_info(info).hash == block.hash == info['hash']
+
+
+@mark.negative
+@mark.parametrize('fields', [{'amount': 1}, {'fee': 0.1}, {'sender': 5}, {'lock_script': 123}, {'timestamp': '1'}])
+def test_non_canonical_transaction(fields: dict):
+    with raises(codec.EncodeError):
+        _ = create_transaction(**fields).hash
+
+
+@mark.negative
+@mark.parametrize('nonce', [codec.MAX_NONCE + 1, 2 ** 64, -1, '1'])
+def test_invalid_nonce(nonce):
+    with raises(codec.EncodeError):
+        codec.encode_nonce(nonce)
+
+
+@mark.negative
+def test_nonce_out_of_range_is_not_decoded():
+    block = Block(1, [create_transaction()], 2, '0')
+    data = bytearray(codec.dumps_block(block))
+    offset = 2 + len(codec.encode_header_prefix(block)) - 1  # version, kind, header without its version
+    data[offset:offset + codec.NONCE_SIZE] = (2 ** 63).to_bytes(codec.NONCE_SIZE, 'big')
+    with raises(codec.DecodeError):
+        codec.loads(bytes(data))
+
+
+@mark.negative
+def test_invalid_utf8():
+    data = codec.dumps_requests([create_transaction(lock_script='éé').request])
+    with raises(codec.DecodeError):
+        codec.loads(data.replace('éé'.encode(), b'\xff\xfe\xff\xfe'))
@@ -18,3 +18,38 @@ def test_transaction(wallet_main: HttpJsonClient, transaction: dict):
     wallet_main.create_transaction(**transaction)
     sleep(10)
     assert is_transaction_in_chain(wallet_main.get_chain(), **transaction)
+
+
+@mark.parametrize('transactions', [[
+    {'amount': '0.2', 'fee': '0.1', 'recipient': 'test_batch_1', 'lock_script': 'locked = False'},
+    {'amount': '0.3', 'fee': '0.1', 'recipient': 'test_batch_2', 'lock_script': None},
+]])
+def test_transactions_batch(wallet_main: HttpJsonClient, transactions: list):
+    required = sum(Decimal(transaction['amount']) + Decimal(transaction['fee']) for transaction in transactions)
+    while not Decimal(wallet_main.get_balance()['balance']) > required:
+        sleep(1)
+    assert wallet_main.create_transactions(transactions)['count'] == len(transactions)
+    sleep(10)
+    chain = wallet_main.get_chain()
+    assert all(is_transaction_in_chain(chain, **transaction) for transaction in transactions)
+
+
+@mark.parametrize('transaction', [{'amount': '0.1', 'fee': '0.1', 'recipient': 'test_history', 'lock_script': None}])
+def test_address_history(wallet_main: HttpJsonClient, transaction: dict):
+    while not Decimal(wallet_main.get_balance()['balance']) > Decimal(transaction['amount']) + Decimal(transaction['fee']):
+        sleep(1)
+    tx_hash = wallet_main.create_transaction(**transaction)['hash']
+    sleep(10)
+    history = wallet_main.get_history(transaction['recipient'])
+    assert [tx['hash'] for tx in history['transactions']] == [tx_hash]
+    assert wallet_main.get_transaction(tx_hash) == history['transactions'][0]
+
+
+@mark.parametrize('transaction', [{'amount': '0.1', 'fee': '0.1', 'recipient': 'test_proof', 'lock_script': None}])
+def test_transaction_proof(wallets: Tuple[HttpJsonClient, ...], wallet_main: HttpJsonClient, transaction: dict):
+    while not Decimal(wallet_main.get_balance()['balance']) > Decimal(transaction['amount']) + Decimal(transaction['fee']):
+        sleep(1)
+    tx_hash = wallet_main.create_transaction(**transaction)['hash']
+    sleep(10)
+    proofs = [wallet.get_proof(tx_hash) for wallet in wallets]
+    assert all(proof and proof['tx_hash'] == tx_hash for proof in proofs)
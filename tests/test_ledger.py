@@ -0,0 +1,160 @@
+import random
+from decimal import Decimal
+from typing import List
+
+from pytest import mark
+
+from src.chain import Block, Blockchain, RawTransaction, Transaction
+from src.ledger import BranchBalances
+from src.miner import Validator
+from src.wallet import Wallet
+
+ADDRESSES = ('a', 'b', 'c', 'root')
+LOCK_SCRIPTS = (None, 'locked = False', 'locked = True', 'locked = time() > 0', 'locked = time() < 0')
+
+
+def create_blocks(previous: Block or None, count: int, rng: random.Random) -> List[Block]:
+    blocks = []
+    for _ in range(count):
+        index = previous.index + 1 if previous else 0
+        transactions = [
+            Transaction('0', '0', RawTransaction(
+                amount=str(rng.randint(1, 9)),
+                fee=str(rng.randint(0, 1)),
+                sender=rng.choice(ADDRESSES),
+                recipient=rng.choice(ADDRESSES),
+                timestamp=rng.randint(1, 10 ** 9),
+                lock_script=rng.choice(LOCK_SCRIPTS),
+            )) for _ in range(rng.randint(1, 5))
+        ]
+        previous = Block(index, transactions, index + 1, previous.hash if previous else '0')
+        blocks.append(previous)
+    return blocks
+
+
+def is_ledger_equal_to_scan(blockchain: Blockchain) -> bool:
+    return all(
+        blockchain.ledger.get_balance(address) == Wallet(address=address).scan_balance(blockchain)
+        for address in ADDRESSES
+    )
+
+
+@mark.positive
+@mark.parametrize('seed', [1, 2, 3])
+def test_ledger_equals_scan(seed: int):
+    blockchain = Blockchain()
+    for block in create_blocks(None, 20, random.Random(seed)):
+        blockchain + block
+    assert is_ledger_equal_to_scan(blockchain)
+
+
+@mark.positive
+@mark.parametrize('seed', [1, 2, 3])
+def test_ledger_reorganization(seed: int):
+    rng = random.Random(seed)
+    blockchain = Blockchain()
+    for block in create_blocks(None, 20, rng):
+        blockchain + block
+    abandoned = blockchain.chain[:]
+    assert blockchain.reorganize(create_blocks(abandoned[13], 11, rng)) is not None
+    assert len(blockchain) == 25 and is_ledger_equal_to_scan(blockchain)
+    assert blockchain.reorganize(create_blocks(abandoned[1], 3, rng)) is None  # less work
+    assert len(blockchain) == 25 and is_ledger_equal_to_scan(blockchain)
+    assert blockchain.reorganize(create_blocks(abandoned[-1], 7, rng)) is not None  # back to the abandoned branch
+    assert blockchain.chain[19].hash == abandoned[19].hash
+    assert len(blockchain) == 27 and is_ledger_equal_to_scan(blockchain)
+
+
+@mark.positive
+def test_ledger_revert():
+    blockchain = Blockchain()
+    states = []
+    for block in create_blocks(None, 12, random.Random(4)):
+        blockchain + block
+        states.append({address: blockchain.ledger.get_balance(address) for address in ADDRESSES})
+    while len(blockchain.chain) > 1:
+        blockchain.ledger.revert(blockchain.chain.pop(), blockchain.chain)
+        assert {address: blockchain.ledger.get_balance(address) for address in ADDRESSES} == states[-2]
+        states.pop()
+
+
+@mark.positive
+@mark.parametrize('seed', [1, 2, 3])
+def test_branch_balances(seed: int):
+    rng = random.Random(seed)
+    blockchain = Blockchain()
+    for block in create_blocks(None, 15, rng):
+        blockchain + block
+    branch = create_blocks(blockchain.chain[9], 8, rng)
+    balances = BranchBalances(blockchain.ledger)
+    for block in blockchain.chain[10:]:
+        balances.apply_block(block, sign=-1)
+    for block in branch:
+        balances.apply_block(block)
+    untouched = blockchain.ledger.dump()
+    expected = {address: balances.get(address) for address in ADDRESSES}
+    assert blockchain.ledger.dump() == untouched
+
+    blockchain.reorganize(branch)
+    for address in ADDRESSES:
+        balance, _, untrusted_balance, _ = blockchain.ledger.get_balance(address)
+        assert expected[address] == balance + untrusted_balance
+
+
+@mark.negative
+def test_branch_balances_unknown_address():
+    blockchain = Blockchain()
+    blockchain.create_initial_block()
+    balances = BranchBalances(blockchain.ledger)
+    assert balances.get('unknown') == Decimal(0)
+    assert balances.get('root') == Blockchain.total_emission
+
+
+@mark.positive
+def test_reorganization_from_genesis_is_atomic():
+    rng = random.Random(5)
+    blockchain = Blockchain()
+    for block in create_blocks(None, 5, rng):
+        blockchain + block
+    chain = blockchain.chain
+    assert blockchain.reorganize(create_blocks(None, 8, rng)) is not None
+    assert len(chain) == 5 and len(blockchain.chain) == 8  # the previous list isn't changed in place
+    assert is_ledger_equal_to_scan(blockchain)
+
+
+class ChainStore:
+    """ Blocks saved to db by another process """
+    def __init__(self, chain: List[Block]):
+        self.chain = chain
+
+    def load_chain(self, *_, start: int = 0) -> List[Block]:
+        return self.chain[start:]
+
+
+@mark.positive
+@mark.parametrize('branch_length', [4, 2])
+def test_update_local_chain_to_reported_tip(branch_length: int):
+    rng = random.Random(6)
+    blockchain = Blockchain()
+    for block in create_blocks(None, 10, rng):
+        blockchain + block
+    chain = blockchain.chain[:6] + create_blocks(blockchain.chain[5], branch_length, rng)
+    blockchain.db = ChainStore(chain)
+    blockchain.update_local_chain()
+    assert len(blockchain) == 10 and blockchain.chain[6].hash != chain[6].hash  # no new blocks above the local chain
+    blockchain.update_local_chain((chain[-1].index, chain[-1].hash))
+    assert [block.hash for block in blockchain.chain] == [block.hash for block in chain]
+    assert is_ledger_equal_to_scan(blockchain)
+
+
+@mark.positive
+@mark.parametrize('seconds, valid', [(50, False), (150, True)])
+def test_time_lock_replayed_at_block_timestamp(seconds: int, valid: bool):
+    blockchain = Blockchain()
+    blockchain.create_initial_block()
+    genesis = blockchain.last_block
+    credit = Transaction('0', '0', RawTransaction('10', '0', 'root', 'a', 1, 'locked = time() < 100'))
+    blockchain + Block(1, [credit], genesis.timestamp + 1, genesis.hash)
+    spend = Transaction('0', '0', RawTransaction('5', '0', 'a', 'b', 2))
+    block = Block(2, [spend, blockchain.pay_fee('b')], seconds * 1_000_000, blockchain.last_block.hash)
+    assert Validator(blockchain).replay_blocks([block]) == int(valid)  # the actual time is past the lock
@@ -0,0 +1,96 @@
+import itertools
+
+from pytest import fixture, mark
+
+from src import mempool as mempool_module
+from src.chain import RawTransaction, Transaction
+from src.mempool import Mempool
+
+
+@fixture
+def clock(monkeypatch):
+    """ Arrival times are 1, 2, 3, ... µs, unless the time is set """
+    time = {'now': None}
+    ticks = itertools.count(1)
+    monkeypatch.setattr(mempool_module, 'actual_time', lambda: time['now'] if time['now'] else next(ticks))
+    return time
+
+
+def create_transaction(fee: str, recipient: str = 'b') -> Transaction:
+    return Transaction('0', '0', RawTransaction('10', fee, 'a', recipient, timestamp=1))  # the same size
+
+
+@mark.positive
+def test_select_by_fee_rate(clock):
+    mempool = Mempool(max_size=100)
+    transactions = [create_transaction(fee, recipient) for fee, recipient in zip('31425', 'abcde')]
+    for transaction in transactions:
+        assert mempool.add(transaction)
+    assert [transaction.raw.fee for transaction in mempool.select(3)] == ['5', '4', '3']
+    assert [transaction.raw.fee for transaction in mempool.select(10)] == ['5', '4', '3', '2', '1']
+    assert len(mempool) == 5  # selection doesn't remove
+
+
+@mark.positive
+def test_select_equal_fee_rate_by_arrival(clock):
+    mempool = Mempool(max_size=100)
+    transactions = [create_transaction('1', recipient) for recipient in 'abcd']
+    for transaction in transactions:
+        mempool.add(transaction)
+    assert mempool.select(4) == transactions
+
+
+@mark.negative
+def test_duplicate(clock):
+    mempool = Mempool(max_size=100)
+    transaction = create_transaction('1')
+    assert mempool.add(transaction)
+    assert not mempool.add(create_transaction('1'))
+    assert len(mempool) == 1 and mempool.select(10) == [transaction]
+
+
+@mark.positive
+def test_remove_and_add_again(clock):
+    mempool = Mempool(max_size=100)
+    cheap, expensive = create_transaction('1'), create_transaction('2')
+    mempool.add(cheap)
+    mempool.add(expensive)
+    mempool.remove([expensive])
+    assert expensive.hash not in mempool and mempool.select(10) == [cheap]
+    assert mempool.add(expensive)
+    assert mempool.select(10) == [expensive, cheap]
+    assert len(mempool.heap) <= 2 * len(mempool) + 1
+
+
+@mark.positive
+def test_evict_by_size(clock):
+    mempool = Mempool(max_size=3)
+    for fee, recipient in zip('2415', 'abcd'):
+        mempool.add(create_transaction(fee, recipient))
+    assert [transaction.raw.fee for transaction in mempool.select(10)] == ['5', '4', '2']
+    assert not mempool.add(create_transaction('1', 'e'))  # cheaper than every pending one
+    assert mempool.add(create_transaction('3', 'f'))
+    assert [transaction.raw.fee for transaction in mempool.select(10)] == ['5', '4', '3']
+
+
+@mark.positive
+def test_evict_equal_fee_rate_newest_first(clock):
+    mempool = Mempool(max_size=2)
+    transactions = [create_transaction('1', recipient) for recipient in 'abc']
+    for transaction in transactions:
+        mempool.add(transaction)
+    assert mempool.select(10) == transactions[:2]
+
+
+@mark.positive
+def test_evict_by_age(clock):
+    mempool = Mempool(max_size=100, max_age=1)
+    clock['now'] = 1_000_000
+    old = create_transaction('5', 'a')
+    mempool.add(old)
+    clock['now'] = 1_500_000
+    new = create_transaction('1', 'b')
+    mempool.add(new)
+    clock['now'] = 2_000_001
+    assert mempool.select(10) == [new]
+    assert len(mempool) == 1
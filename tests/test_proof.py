@@ -0,0 +1,58 @@
+import random
+from typing import List
+
+from pytest import mark
+
+from src import merkle
+from src.chain import Block, Blockchain, RawTransaction, Transaction
+
+
+def create_hashes(count: int) -> List[str]:
+    rng = random.Random(count)
+    return [rng.randbytes(32).hex() for _ in range(count)]
+
+
+@mark.positive
+@mark.parametrize('count', [1, 2, 3, 4, 5, 7, 8, 9, 16, 33])
+def test_merkle_proof(count: int):
+    hashes = create_hashes(count)
+    root = merkle.get_root(hashes)
+    for index, leaf in enumerate(hashes):
+        assert merkle.verify_proof(leaf, merkle.get_proof(hashes, index), root)
+
+
+@mark.negative
+@mark.parametrize('count', [2, 5, 8])
+def test_merkle_proof_tampered(count: int):
+    hashes = create_hashes(count)
+    root = merkle.get_root(hashes)
+    proof = merkle.get_proof(hashes, 1)
+    assert not merkle.verify_proof(hashes[0], proof, root)
+    assert not merkle.verify_proof(hashes[1], [{**proof[0], 'hash': hashes[1]}] + proof[1:], root)
+    assert not merkle.verify_proof(hashes[1], proof, merkle.EMPTY_ROOT)
+
+
+@mark.positive
+def test_blockchain_proof():
+    blockchain = Blockchain()
+    blockchain.create_initial_block()
+    transactions = []
+    for index in range(1, 6):
+        block_transactions = [
+            Transaction('0', '0', RawTransaction(str(amount), '0', 'root', 'a', timestamp=index * 10 + amount))
+            for amount in range(1, index + 1)
+        ]
+        blockchain + Block(index, block_transactions, index, blockchain.last_block.hash)
+        transactions += block_transactions
+    for transaction in transactions:
+        proof = blockchain.get_proof(transaction.hash)
+        block = blockchain.chain[proof['block_index']]
+        assert transaction in block.transactions and proof['block_hash'] == block.hash
+        assert merkle.verify_proof(transaction.hash, proof['proof'], block.merkle_root)
+
+
+@mark.negative
+def test_blockchain_proof_unknown():
+    blockchain = Blockchain()
+    blockchain.create_initial_block()
+    assert blockchain.get_proof('0' * 64) is None
@@ -0,0 +1,46 @@
+from pytest import mark
+
+from src.script import ScriptEngine
+
+
+@mark.positive
+@mark.parametrize('source, locked', [
+    ('locked = True', True),
+    ('locked = time() < 0', False),
+    ('x = 5\nif x > 3:\n    locked = False\nelse:\n    locked = True', False),
+    ('locked = 1 < 2 < 3 and not 0', True),
+    ('locked = "ab" * 2 == "abab"', True),
+])
+def test_lock_script(source: str, locked: bool):
+    assert ScriptEngine().validate(source) == (True, 0)
+    assert ScriptEngine().is_locked(source) is locked
+
+
+@mark.positive
+@mark.parametrize('timestamp, locked', [(None, False), (99_999_999, True), (100_000_000, False)])
+def test_lock_script_at_timestamp(timestamp: int or None, locked: bool):
+    assert ScriptEngine().validate('locked = time() < 100', timestamp) == (True, 0)
+    assert ScriptEngine().is_locked('locked = time() < 100', timestamp) is locked
+
+
+@mark.negative
+@mark.parametrize('source', [
+    'import os',
+    'while True:\n    pass',
+    'locked = 2 ** 10',
+    'locked = "a" * 100_000_000',
+    'a = 99999999999999999999\nb = a * a\nc = b * b\nd = c * c\ne = d * d\nlocked = e > 0',
+    'locked = ' + ' + '.join(['1'] * 200),
+    'locked = 1 / 0',
+    'locked = undefined',
+    'locked = 1',
+    'locked = "%0100000000d" % 1 == ""',
+    'locked = b"%0100000000d" % 1 == b""',
+    123,
+    b'locked = False',
+])
+def test_invalid_lock_script(source):
+    engine = ScriptEngine()
+    validated, _ = engine.validate(source)
+    assert not validated
+    assert engine.is_locked(source)
@@ -0,0 +1,108 @@
+import os
+from typing import List
+
+from pytest import fixture, mark, raises
+
+from src import codec
+from src.chain import Block, RawTransaction, Transaction
+from src.db.segments import SegmentStore
+
+SEGMENT_SIZE = 2000  # bytes, a few blocks per segment
+
+
+def create_blocks(previous: Block or None, count: int, timestamp: int = 1) -> List[Block]:
+    blocks = []
+    for _ in range(count):
+        index = previous.index + 1 if previous else 0
+        transactions = [
+            Transaction('0', '0', RawTransaction(str(index), '1', f'a{position}', 'b', timestamp=timestamp))
+            for position in range(3)
+        ]
+        previous = Block(index, transactions, timestamp + index, previous.hash if previous else '0')
+        blocks.append(previous)
+    return blocks
+
+
+def get_hashes(store: SegmentStore) -> List[str]:
+    return [Block.from_info(info).hash for info in store.load()]
+
+
+@fixture
+def path(tmp_path) -> str:
+    return str(tmp_path / 'chain.segments')
+
+
+@mark.positive
+def test_append_and_read(path: str):
+    store = SegmentStore(path, segment_size=SEGMENT_SIZE)
+    blocks = create_blocks(None, 30)
+    store.append(blocks)
+    assert len(os.listdir(path)) > 2  # index and several segments
+    assert get_hashes(store) == [block.hash for block in blocks]
+    assert Block.from_info(store.read(17)).hash == blocks[17].hash
+    transaction = blocks[5].transactions[1]
+    assert store.get_transaction(transaction.hash)['block_index'] == 5
+    history = store.get_history('a1', None, 3)
+    assert [position for position, _ in history] == [(29, 1), (28, 1), (27, 1)]
+
+
+@mark.positive
+def test_reopen(path: str):
+    blocks = create_blocks(None, 30)
+    SegmentStore(path, segment_size=SEGMENT_SIZE).append(blocks)
+    store = SegmentStore(path, segment_size=SEGMENT_SIZE)
+    assert len(store) == 30 and get_hashes(store) == [block.hash for block in blocks]
+
+
+@mark.positive
+def test_truncate_and_replace_tail(path: str):
+    writer = SegmentStore(path, segment_size=SEGMENT_SIZE)
+    blocks = create_blocks(None, 30)
+    writer.append(blocks)
+    reader = SegmentStore(path, segment_size=SEGMENT_SIZE)  # of another process
+    branch = create_blocks(blocks[9], 25, timestamp=1000)
+    writer.truncate(10)
+    assert len(writer) == 10
+    writer.append(branch)
+    expected = [block.hash for block in blocks[:10] + branch]
+    assert get_hashes(writer) == expected
+    assert get_hashes(reader) == expected  # the replaced tail is reloaded
+    assert reader.get_transaction(blocks[20].transactions[0].hash) is None
+    assert reader.get_transaction(branch[0].transactions[0].hash)['block_index'] == 10
+
+
+@mark.negative
+def test_partially_written_block(path: str):
+    store = SegmentStore(path, segment_size=SEGMENT_SIZE)
+    blocks = create_blocks(None, 10)
+    store.append(blocks)
+    segment, offset, _, _ = store.entries[-1]
+    with open(store.get_segment_path(segment), 'ab') as file:
+        file.truncate(offset + 5)  # the last block is cut, its index entry is written
+    reopened = SegmentStore(path, segment_size=SEGMENT_SIZE)
+    assert len(reopened) == 9
+    assert os.path.getsize(reopened.index_path) == 9 * SegmentStore.INDEX_ENTRY.size
+    reopened.append(blocks[9:])
+    assert get_hashes(SegmentStore(path, segment_size=SEGMENT_SIZE)) == [block.hash for block in blocks]
+
+
+@mark.negative
+def test_truncated_under_reader(path: str):
+    writer = SegmentStore(path, segment_size=SEGMENT_SIZE)
+    writer.append(create_blocks(None, 3))
+    reader = SegmentStore(path, segment_size=SEGMENT_SIZE)
+    reader.read(2)
+    writer.truncate(1)
+    with raises(codec.DecodeError):
+        reader.read(2)
+    assert len(reader.load()) == 1
+
+
+@mark.negative
+def test_older_header_version_dropped(path: str):
+    store = SegmentStore(path, segment_size=SEGMENT_SIZE)
+    store.append(create_blocks(None, 3))
+    store.close()
+    with open(store.get_segment_path(0), 'r+b') as file:
+        file.write(bytes((codec.HEADER_VERSION - 1,)))
+    assert len(SegmentStore(path, segment_size=SEGMENT_SIZE)) == 0
@@ -0,0 +1,38 @@
+from pytest import mark
+
+from src.chain import Transaction
+from src.signatures import SignatureVerifier, verify
+from src.wallet import Wallet
+
+WALLET = Wallet()
+
+
+@mark.positive
+def test_valid_signature():
+    transaction = WALLET.create_transaction(amount='1', fee='0', recipient='a')
+    assert verify(transaction.public_key, transaction.signature, transaction.raw.hash)
+
+
+@mark.negative
+@mark.parametrize('public_key, signature', [
+    (None, 'valid'),
+    ('valid', None),
+    (123, 'valid'),
+    ('valid', 123),
+    ('not hex', 'valid'),
+    ('valid', '0OIl'),  # not base58
+    ('04' + '00' * 64, 'valid'),
+    (['04'], 'valid'),
+])
+def test_malformed_signature(public_key, signature):
+    transaction = WALLET.create_transaction(amount='1', fee='0', recipient='a')
+    public_key = transaction.public_key if public_key == 'valid' else public_key
+    signature = transaction.signature if signature == 'valid' else signature
+    assert not verify(public_key, signature, transaction.raw.hash)
+
+
+@mark.negative
+def test_malformed_signature_in_batch():
+    valid = WALLET.create_transaction(amount='1', fee='0', recipient='a')
+    malformed = Transaction(valid.signature, None, valid.raw)
+    assert SignatureVerifier(workers=1).verify_batch([malformed, valid]) == [False, True]
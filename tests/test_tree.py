@@ -0,0 +1,25 @@
+import random
+
+from pytest import mark
+
+from src.chain import Blockchain
+from src.tree import BlockTree
+from tests.test_ledger import create_blocks
+
+
+@mark.positive
+def test_side_branches_pruned_after_reorganization():
+    rng = random.Random(6)
+    blockchain = Blockchain()
+    for block in create_blocks(None, 10, rng):
+        blockchain + block
+    side = create_blocks(blockchain.chain[4], 3, rng)
+    assert blockchain.reorganize(side) is None  # less work, kept in the tree
+    assert all(block.hash in blockchain.tree for block in side)
+    previous = blockchain.last_block
+    for _ in range(3):  # the chain grows by synchronization only
+        branch = create_blocks(previous, BlockTree.KEEP_DEPTH // 2, rng)
+        assert blockchain.reorganize(branch) is not None
+        previous = branch[-1]
+    assert not any(block.hash in blockchain.tree for block in side)
+    assert all(block.hash in blockchain.tree for block in blockchain.chain[-BlockTree.KEEP_DEPTH:])